@@ -1,34 +1,311 @@
 import collections
-import copy
+import itertools
 import logging
 import os
 import Queue
+import select
+import signal
+import stat
 import subprocess
 import threading
 import time
 import traceback
 
+from . import ignore
+from .profiler import InstrumentedLock, register_thread
+from .scheduler import scheduler
 from .utils import ComputationInterruptedException, UNINITIALIZED
-from .utils import get_config, split_search_dir_and_query
+from .utils import get_config, path_cache, split_search_dir_and_query
 
 _logger = logging.getLogger(__name__)
 
-CurrentFilenames = collections.namedtuple("CurrentFilenames", [ "candidates", "candidate_computation_complete", "git_root_dir", "current_search_dir" ])
+def _iter_line_batches(f, timeout=0.05):
+    """ Yields lists of lines from f as they arrive, or an empty list every timeout seconds while we're waiting for more (so callers can check whether they've been interrupted). """
+    fd = f.fileno()
+    partial_line = ""
+    while True:
+        ready, _, _ = select.select([ fd ], [], [], timeout)
+        if not ready:
+            yield []
+            continue
+
+        data = os.read(fd, 64 * 1024)
+        if not data:
+            if partial_line:
+                yield [ partial_line ]
+            return
+
+        lines = (partial_line + data).split("\n")
+        partial_line = lines.pop()
+        yield lines
+
+def _iter_command_line_batches(cmd, cwd=None, shell=False):
+    """ Yields batches of lines from cmd's output, like _iter_line_batches().  The command (and anything it started) is killed if we stop early. """
+    with open(os.devnull, "w") as devnull:
+        # run it in its own process group, so a shell pipeline's children can be killed along with it
+        proc = subprocess.Popen(cmd, cwd=cwd, shell=shell, stdout=subprocess.PIPE, stderr=devnull, preexec_fn=os.setsid)
+    _logger.debug("Started cmd {} with pid {:d}".format(cmd, proc.pid))
+    try:
+        for lines in _iter_line_batches(proc.stdout):
+            yield lines
+        proc.wait()
+    finally:
+        if proc.poll() is None:
+            _logger.debug("Command stopped early.  Killing process group {:d}.".format(proc.pid))
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.communicate()
+            except OSError:
+                pass
+
+class _ConcurrentCommands(object):
+    """ Runs (cwd, args) commands, up to max_running at a time, and yields (command, filenames, finished) as output arrives from any of them.
+
+    Each line of output is a filename relative to the command's cwd, and finished is True for a command's last batch.
+    commands can be a generator, in which case the next command is only asked for once there's room to start it.
+    More commands can be queued up with add() (ahead of the rest of commands) and a running one stopped with kill(),
+    even while iterating.  (None, [], False) is yielded every timeout seconds while we're waiting for output, and
+    whatever's still running is killed if we stop early.
+    """
+
+    def __init__(self, commands, max_running=8, timeout=0.05):
+        super(_ConcurrentCommands, self).__init__()
+        self.commands = iter(commands)
+        self.max_running = max_running
+        self.timeout = timeout
+        self.added_commands = collections.deque()
+        self.running = {}           # stdout fd -> [ proc, command, partial_line ]
+
+    def add(self, command):
+        self.added_commands.append(command)
+
+    def _next_command(self):
+        if self.added_commands:
+            return self.added_commands.popleft()
+        return next(self.commands, None)
+
+    @staticmethod
+    def _kill(proc):
+        _logger.debug("Command stopped early.  Killing pid {:d}.".format(proc.pid))
+        try:
+            proc.kill()
+            proc.communicate()
+        except OSError:
+            pass
+
+    def kill(self, command):
+        """ Stops a running command.  We won't hear from it again. """
+        for fd, (proc, running_command, _) in self.running.items():
+            if running_command is command:
+                del self.running[fd]
+                self._kill(proc)
+
+    def close(self):
+        for proc, _, _ in self.running.values():
+            self._kill(proc)
+        self.running = {}
+
+    def __iter__(self):
+        try:
+            with open(os.devnull, "w") as devnull:
+                while True:
+                    while len(self.running) < self.max_running:
+                        command = self._next_command()
+                        if command is None:
+                            break
+                        cwd, args = command
+                        proc = subprocess.Popen(args, cwd=cwd, stdout=subprocess.PIPE, stderr=devnull)
+                        _logger.debug("Started cmd {} in {} with pid {:d}".format(args, cwd, proc.pid))
+                        self.running[proc.stdout.fileno()] = [ proc, command, "" ]
+
+                    if not self.running:
+                        return
+
+                    ready, _, _ = select.select(list(self.running), [], [], self.timeout)
+                    if not ready:
+                        yield None, [], False
+                        continue
+
+                    for fd in ready:
+                        if fd not in self.running:
+                            # killed while we were yielding
+                            continue
+                        proc, command, partial_line = self.running[fd]
+                        cwd = command[0]
+                        data = os.read(fd, 64 * 1024)
+                        if not data:
+                            del self.running[fd]
+                            proc.stdout.close()
+                            proc.wait()
+                            yield command, [ os.path.join(cwd, partial_line) ] if partial_line else [], True
+                        else:
+                            lines = (partial_line + data).split("\n")
+                            self.running[fd][2] = lines.pop()
+                            yield command, [ os.path.join(cwd, line) for line in lines if line ], False
+        finally:
+            self.close()
+
+def _unquote_git_config_value(value):
+    """ Strips the quotes, escapes and trailing comment from a git config value. """
+    unquoted = []
+    quoted = False
+    chars = iter(value.strip())
+    for ch in chars:
+        if ch == "\\":
+            escaped = next(chars, "")
+            unquoted.append({ "n": "\n", "t": "\t", "b": "\b" }.get(escaped, escaped))
+        elif ch == '"':
+            quoted = not quoted
+        elif ch in "#;" and not quoted:
+            break
+        else:
+            unquoted.append(ch)
+    return "".join(unquoted).strip()
+
+def parse_gitmodules(gitmodules_fn):
+    """ Returns the paths (relative to the repository) of the submodules in a .gitmodules file, without asking git. """
+    try:
+        f = open(gitmodules_fn, "r")
+    except IOError:
+        return []
+
+    paths = []
+    in_submodule_section = False
+    with f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("["):
+                in_submodule_section = line[1:].lstrip().startswith("submodule")
+            elif in_submodule_section:
+                key, sep, value = line.partition("=")
+                if sep and key.strip().lower() == "path":
+                    paths.append(_unquote_git_config_value(value))
+    return [ path for path in paths if path ]
+
+class CandidateSource(object):
+    """ Somewhere to get candidate filenames from instead of asking git or walking the filesystem. """
+
+    def get_batches(self, search_dir):
+        """ Yields lists of absolute filenames (some of which may be outside search_dir) as they arrive, or an empty list whenever we're still waiting for more. """
+        raise NotImplementedError()
+
+class CommandSource(CandidateSource):
+    """ Runs a shell command in the search directory and uses every line of its output as a filename (relative to the search directory). """
+
+    def __init__(self, cmd):
+        super(CommandSource, self).__init__()
+        self.cmd = cmd
+
+    def __str__(self):
+        return "command '{}'".format(self.cmd)
+
+    def get_batches(self, search_dir):
+        for lines in _iter_command_line_batches(self.cmd, cwd=search_dir, shell=True):
+            yield [ os.path.join(search_dir, line) for line in lines if line ]
+
+class FileListSource(CandidateSource):
+    """ Reads filenames (relative to base_dir) from a file, one per line, e.g. a manifest written by a build system. """
+
+    def __init__(self, list_fn, base_dir):
+        super(FileListSource, self).__init__()
+        self.list_fn = list_fn
+        self.base_dir = base_dir
+
+    def __str__(self):
+        return "file list {}".format(self.list_fn)
+
+    def get_batches(self, search_dir):
+        try:
+            f = open(self.list_fn, "rb")
+        except IOError as e:
+            _logger.debug("Couldn't open {}: {}".format(self.list_fn, e))
+            return
+
+        with f:
+            for lines in _iter_line_batches(f):
+                yield [ os.path.join(self.base_dir, line) for line in lines if line ]
+
+class StdinSource(CandidateSource):
+    """ Reads filenames (relative to base_dir) from a stream like a pipe, which can only be read once.
+
+    Everything we've read is kept around, so switching search directories replays it before reading any more.
+    """
+
+    def __init__(self, stream, base_dir):
+        super(StdinSource, self).__init__()
+        self.stream = stream
+        self.base_dir = base_dir
+        self.lines = _iter_line_batches(stream)
+        self.fns_so_far = []
+        self.exhausted = False
+
+    def __str__(self):
+        return "standard input"
+
+    def get_batches(self, search_dir):
+        yield self.fns_so_far[:]
+        while not self.exhausted:
+            try:
+                lines = next(self.lines)
+            except StopIteration:
+                self.exhausted = True
+                return
+            fns = [ os.path.join(self.base_dir, line) for line in lines if line ]
+            self.fns_so_far.extend(fns)
+            yield fns
+
+class CandidateSnapshot(object):
+    """ The first length candidates of a FilenameCollectionThread's (append-only) candidate list.
+
+    Taking one is O(1), so the UI can do it every frame without copying every candidate under the collection
+    thread's state_lock.  Membership is checked against the collection thread's (growing) set of candidates, so it
+    might include a few that came in after the snapshot was taken.
+    """
+
+    def __init__(self, fns, length, fn_set):
+        super(CandidateSnapshot, self).__init__()
+        self.fns = fns
+        self.length = length
+        self.fn_set = fn_set
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return itertools.islice(self.fns, self.length)
+
+    def __contains__(self, fn):
+        return fn in self.fn_set
+
+    def difference(self, other):
+        return set(self).difference(other)
+
+    def get_added_since(self, prev):
+        """ Returns the candidates added since an earlier snapshot prev of the same collection (or None if prev isn't one). """
+        if not isinstance(prev, CandidateSnapshot) or prev.fns is not self.fns or prev.length > self.length:
+            return None
+        return self.fns[prev.length:self.length]
+
+CurrentFilenames = collections.namedtuple("CurrentFilenames", [ "candidates", "candidate_computation_complete", "candidate_computation_truncated", "git_root_dir", "current_search_dir" ])
 class FilenameCollectionThread(threading.Thread):
-    def __init__(self, initial_input_str):
+    def __init__(self, initial_input_str, candidate_source=None):
         super(FilenameCollectionThread, self).__init__()
         self.daemon = True
         self.ex_traceback = None
 
         self.should_stop = False
         self.search_dir_queue = Queue.Queue()
-        self.state_lock = threading.Lock()            # for updating shared state
+        self.state_lock = InstrumentedLock("FilenameCollectionThread.state_lock") # for updating shared state
 
-        self.current_search_dir = None                # only re-run find/git if the search directory changes
+        self.current_search_dir = None                # only re-walk/re-run git if the search directory changes
         self.candidate_computation_complete = False   # are we done getting all filenames for the current search directory?
+        self.candidate_computation_truncated = False  # did we stop getting filenames early because we ran out of budget?
+        self.truncated_search_dirs = set()            # search directories whose cached candidate filenames are incomplete
         self.candidate_fns_cache = {}                 # cache for candidate filenames given an input_str
         self.candidate_fns = UNINITIALIZED            # current set of candidate functions
+        self.candidate_list = []                      # ...and the same, in the order we found them (only ever appended to, so it can be snapshotted)
         self.git_root_dir = UNINITIALIZED             # git root directory
+        self.candidate_source = candidate_source      # CandidateSource to use instead of git or walking the filesystem (or None)
 
         self.update_input_str(initial_input_str)
 
@@ -49,6 +326,7 @@ class FilenameCollectionThread(threading.Thread):
 
     def run(self):
         try:
+            register_thread()
             while True:
                 if self.should_stop:
                     return
@@ -66,11 +344,16 @@ class FilenameCollectionThread(threading.Thread):
 
                     self.current_search_dir = next_search_dir
 
+                    # we're about to look at the filesystem again, so don't trust what we've seen before
+                    path_cache.invalidate()
+
                     # indicate that we're not done computing
                     self.candidate_computation_complete = False
 
                     # reset
                     self.candidate_fns = set()
+                    self.candidate_list = []
+                    self.candidate_computation_truncated = False
 
                 try:
                     self._compute_candidates()
@@ -80,7 +363,9 @@ class FilenameCollectionThread(threading.Thread):
 
                 with self.state_lock:
                     # this set of candidate filenames is definitely done, so add it to the cache!
-                    self.candidate_fns_cache[self.current_search_dir] = self.candidate_fns
+                    self.candidate_fns_cache[self.current_search_dir] = self.candidate_list
+                    if self.candidate_computation_truncated:
+                        self.truncated_search_dirs.add(self.current_search_dir)
 
                     # we're done, as long as no one has queued us up for more
                     self.candidate_computation_complete = self.search_dir_queue.empty()
@@ -88,6 +373,21 @@ class FilenameCollectionThread(threading.Thread):
             self.ex_traceback = traceback.format_exc()
             raise
 
+    def _add_dirnames(self, batch, abs_fn):
+        """ Adds abs_fn and all its parent directories (up to the search directory) to batch. """
+        while abs_fn != self.current_search_dir and abs_fn not in batch:
+            batch.add(abs_fn)
+            abs_fn = os.path.dirname(abs_fn)
+
+    def _add_candidates(self, batch):
+        """ Publishes a batch of candidate filenames, once any search for the latest input has had its turn. """
+        scheduler.yield_to_search()
+        new_fns = [ fn for fn in batch if fn not in self.candidate_fns ]
+        if new_fns:
+            with self.state_lock:
+                self.candidate_fns.update(new_fns)
+                self.candidate_list.extend(new_fns)
+
     @staticmethod
     def _get_shell_output(cmd):
         # don't use check_output because it won't swallow stderr
@@ -103,88 +403,288 @@ class FilenameCollectionThread(threading.Thread):
         with self.state_lock:
             self.git_root_dir = git_root_dir
 
-        def append_batched_filenames(cmd, base_dir=None, shell=False, add_dirnames=False):
-            """ Adds all the files from the output of this command to our candidate_fns in batches. """
-            BATCH_SIZE = 100
+        cache_key = self.current_search_dir
+        if cache_key in self.candidate_fns_cache:
+            _logger.debug("Found candidate_fn cache key: {}".format(cache_key))
+            # a finished candidate list is never appended to again, so it's safe to share
+            candidate_list = self.candidate_fns_cache[cache_key]
+            candidate_fns = set(candidate_list)
+            with self.state_lock:
+                self.candidate_fns = candidate_fns
+                self.candidate_list = candidate_list
+                self.candidate_computation_truncated = cache_key in self.truncated_search_dirs
 
-            proc = subprocess.Popen(cmd, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            _logger.debug("Started cmd {} with pid {:d}".format(cmd, proc.pid))
-            batch = set()
-            while True:
-                if self._interrupted():
-                    _logger.debug("Command interrupted.  Killing pid {:d}.".format(proc.pid))
-                    try:
-                        proc.kill()
-                        proc.communicate()
-                    except OSError:
-                        pass
-                    raise ComputationInterruptedException("Interrupted while executing: {}".format(cmd))
+        elif self.candidate_source is not None:
+            _logger.debug("Getting candidates for {} from {}".format(self.current_search_dir, self.candidate_source))
+            self._append_batches(self.candidate_source.get_batches(self.current_search_dir), add_dirnames=get_config("include_directories"), only_search_dir=True)
+
+        elif self.git_root_dir is not None:
+            # return files that git recognizes, in this current search directory and any submodules below it (all listed concurrently)
+            # ...untracked directories come back whole, and only the small ones get expanded
+            self._append_batches(self._iter_git_fns(), add_dirnames=get_config("include_directories"))
+
+        else:
+            # walk the current_search_dir ourselves so we can prune ignored directories
+            # ...huge roots get a budgeted walk so that shallow (likely) files show up first
+            self._compute_walked_candidates(budgeted=self._is_breadth_first_root(self.current_search_dir))
 
-                nextline = proc.stdout.readline().strip()
-                if nextline == "" and proc.poll() != None:
+    def _append_batches(self, batches, base_dir=None, add_dirnames=False, only_search_dir=False):
+        """ Adds every filename in batches (an iterator of lists, e.g. from a CandidateSource) to our candidate_fns, checking for interruptions along the way.
+
+        If only_search_dir, filenames outside of the current search directory are skipped.
+        """
+        search_dir_prefix = os.path.join(self.current_search_dir, "")
+        iter_batches = iter(batches)
+        try:
+            for fns in iter_batches:
+                if self._interrupted():
+                    raise ComputationInterruptedException("Interrupted while collecting candidates for {}".format(self.current_search_dir))
+
+                batch = set()
+                for fn in fns:
+                    fn = fn.strip()
+                    if not fn:
+                        continue
+                    abs_fn = os.path.abspath(os.path.join(base_dir, fn) if base_dir is not None else fn)
+                    if only_search_dir and not abs_fn.startswith(search_dir_prefix):
+                        continue
+                    if add_dirnames:
+                        self._add_dirnames(batch, abs_fn)
+                    else:
+                        batch.add(abs_fn)
+
+                if batch:
+                    self._add_candidates(batch)
+        finally:
+            # stop whatever's generating the batches (e.g. kill a command)
+            if hasattr(iter_batches, "close"):
+                iter_batches.close()
+
+    UNTRACKED_LS_FILES_ARGS = [ "git", "-c", "core.untrackedCache=true", "ls-files", "--exclude-standard", "--others" ]
+
+    _UntrackedExpansion = collections.namedtuple("_UntrackedExpansion", [ "untracked_dir", "is_search_dir", "max_entries", "fns" ])
+
+    def _iter_git_fns(self):
+        """ Yields batches of the filenames git lists for the current search directory (and submodules), all listed concurrently.
+
+        Untracked directories come back whole (ending in a slash), and only small ones are expanded (by more commands
+        alongside the rest).  Bigger untracked directories stay as a single (directory) candidate, which can be
+        searched by typing into it, and no more than git_untracked_max_entries files are ever expanded in all.  If the
+        whole search directory is untracked (because we've typed into one), we list as much of it as we can.
+        """
+        collapse_threshold = get_config("git_untracked_collapse_threshold", 1000)
+        untracked_budget = [ get_config("git_untracked_max_entries", 50000) ] # (each expansion holds on to its max_entries until it's done)
+
+        commands = _ConcurrentCommands(self._iter_git_ls_files_commands())
+        expansions = {}                         # id(command) -> _UntrackedExpansion for the ones running
+        waiting_dirs = collections.deque()      # untracked directories we haven't started expanding
+
+        def start_expansions():
+            """ Starts expanding the waiting untracked directories we've got budget for, and returns the ones we won't expand. """
+            not_expanded = []
+            while waiting_dirs:
+                untracked_dir = waiting_dirs[0]
+                is_search_dir = untracked_dir == self.current_search_dir
+                max_entries = untracked_budget[0] if is_search_dir else min(untracked_budget[0], collapse_threshold)
+                if max_entries < collapse_threshold and not is_search_dir and expansions:
+                    # wait for whatever budget the running ones don't use
                     break
 
-                fn = os.path.join(base_dir, nextline) if base_dir is not None else nextline
-                if not fn:
+                waiting_dirs.popleft()
+                expansion = self._UntrackedExpansion(untracked_dir, is_search_dir, max_entries, [])
+                if max_entries <= 0:
+                    self._untracked_dir_not_expanded(expansion, collapse_threshold)
+                    not_expanded.append(expansion)
                     continue
 
-                abs_fn = os.path.abspath(fn)
-                if add_dirnames:
-                    def add_dirs_rec(name):
-                        if name != self.current_search_dir and name not in batch:
-                            batch.add(name)
-                            add_dirs_rec(os.path.dirname(name))
-                    add_dirs_rec(abs_fn)
-                else:
-                    batch.add(abs_fn)
-
-                if len(batch) >= BATCH_SIZE:
-                    with self.state_lock:
-                        self.candidate_fns.update(batch)
-                        batch = set()
+                untracked_budget[0] -= max_entries
+                expansion_command = (untracked_dir, self.UNTRACKED_LS_FILES_ARGS)
+                expansions[id(expansion_command)] = expansion
+                commands.add(expansion_command)
+            return [ expansion.untracked_dir for expansion in not_expanded if not expansion.is_search_dir ]
 
-            if batch:
-                with self.state_lock:
-                    # clean up the stragglers
-                    self.candidate_fns.update(batch)
+        try:
+            for command, fns, finished in commands:
+                expansion = expansions.get(id(command))
+                if expansion is None:
+                    untracked_dirs = [ fn for fn in fns if fn.endswith("/") ]
+                    if untracked_dirs:
+                        yield [ fn for fn in fns if not fn.endswith("/") ]
+                        waiting_dirs.extend( os.path.normpath(untracked_dir) for untracked_dir in untracked_dirs )
+                        yield start_expansions()
+                    else:
+                        yield fns
+                    continue
 
-        cache_key = self.current_search_dir
-        if cache_key in self.candidate_fns_cache:
-            _logger.debug("Found candidate_fn cache key: {}".format(cache_key))
+                # we only know a directory's small enough to expand once it's all there (but the search directory itself streams in)
+                num_listed = len(expansion.fns)
+                expansion.fns.extend(fns[:expansion.max_entries + 1 - num_listed])
+                if expansion.is_search_dir:
+                    yield expansion.fns[num_listed:expansion.max_entries]
+
+                complete = len(expansion.fns) <= expansion.max_entries
+                if not complete:
+                    commands.kill(command)
+                if finished or not complete:
+                    del expansions[id(command)]
+                    # a collapsed directory doesn't use up any budget (but the search directory keeps what it's shown)
+                    num_used = len(expansion.fns) if complete else (expansion.max_entries if expansion.is_search_dir else 0)
+                    untracked_budget[0] += expansion.max_entries - num_used
+                    if complete and not expansion.is_search_dir:
+                        yield expansion.fns
+                    elif not complete:
+                        self._untracked_dir_not_expanded(expansion, collapse_threshold)
+                        if not expansion.is_search_dir:
+                            yield [ expansion.untracked_dir ]
+                    yield start_expansions()
+        finally:
+            commands.close()
+
+    def _untracked_dir_not_expanded(self, expansion, collapse_threshold):
+        _logger.debug("Not expanding untracked directory {} (more than {:d} files).".format(expansion.untracked_dir, expansion.max_entries))
+        if expansion.is_search_dir or expansion.max_entries < collapse_threshold:
+            # we ran out of budget (rather than collapsing a big directory on purpose)
             with self.state_lock:
-                self.candidate_fns.update(self.candidate_fns_cache[cache_key])
+                self.candidate_computation_truncated = True
+
+    def _iter_git_ls_files_commands(self):
+        """ Yields the (cwd, args) git commands that list the current search directory's files and then those of each submodule below it.
+
+        Submodules are found by reading .gitmodules files ourselves (recursively), which is much quicker than asking
+        git for their status, so the current search directory's files never wait on them.
+        """
+        LS_FILES_ARGS = (
+                [ "git", "ls-files", "--cached" ],
+                # git only uses the untracked cache with exactly these flags (the same ones git status uses)
+                self.UNTRACKED_LS_FILES_ARGS + [ "--directory", "--no-empty-directory" ])
+
+        for args in LS_FILES_ARGS:
+            yield self.current_search_dir, args
+
+        search_dir_prefix = os.path.join(self.current_search_dir, "")
+        repo_dirs = [ self.git_root_dir ]
+        while repo_dirs:
+            repo_dir = repo_dirs.pop(0)
+            for submodule in parse_gitmodules(os.path.join(repo_dir, ".gitmodules")):
+                submodule_root = os.path.normpath(os.path.join(repo_dir, submodule))
+                if not submodule_root.startswith(search_dir_prefix) or not os.path.exists(os.path.join(submodule_root, ".git")):
+                    # not our concern (or not checked out)
+                    continue
 
-        elif self.git_root_dir is not None:
-            # return files that git recognizes
+                _logger.debug("Found submodule: {}".format(submodule_root))
+                repo_dirs.append(submodule_root)
+                for args in LS_FILES_ARGS:
+                    yield submodule_root, args
+
+    @staticmethod
+    def _is_breadth_first_root(search_dir):
+        return any( os.path.abspath(os.path.expanduser(root)) == search_dir for root in get_config("breadth_first_roots", []) )
+
+    def _compute_walked_candidates(self, budgeted):
+        """ Walks current_search_dir level by level, following symlinks like find -L.
+
+        Anything matched by the prune_directories config or by .gitignore/.ignore files along the way is skipped, and
+        ignored directories are never listed.  A directory that's also one of its own parents (by inode) is listed but not
+        walked again, which breaks symlink cycles; any other directory reachable by more than one path is walked under
+        each.  If budgeted, we stop early once we've run out of the breadth-first entry budgets and optionally don't
+        descend into other filesystems.
+        """
+        BATCH_SIZE = 100
+
+        if budgeted:
+            max_entries = get_config("breadth_first_max_entries")
+            max_entries_per_level = get_config("breadth_first_max_entries_per_level")
+            same_filesystem = get_config("breadth_first_same_filesystem")
+        else:
+            max_entries = max_entries_per_level = float("inf")
+            same_filesystem = False
+        include_directories = get_config("include_directories")
+        find_hidden_files = get_config("find_hidden_files")
+        find_hidden_directories = get_config("find_hidden_directories")
+        read_ignore_files = get_config("read_ignore_files", True)
+
+        try:
+            root_stat = os.stat(self.current_search_dir)
+        except OSError:
+            return
+
+        # prune_directories are basenames (or globs) of directories to skip anywhere below the search directory
+        root_rules = ignore.IgnoreRules(self.current_search_dir, [ "{}/".format(pattern.rstrip("/")) for pattern in get_config("prune_directories", []) ])
+
+        num_entries = 0
+        batch = set()
+        level = [ (self.current_search_dir, (root_rules,) if root_rules else (), frozenset([ (root_stat.st_dev, root_stat.st_ino) ])) ]
+        while level and num_entries < max_entries:
+            next_level = []
+            num_level_entries = 0
+            for dirname, rules_chain, parent_dirs in level:
+                if self._interrupted():
+                    raise ComputationInterruptedException("Interrupted while walking {}".format(dirname))
 
-            # start with this current search directory
-            search_dirs = [ self.current_search_dir ]
+                if num_level_entries >= max_entries_per_level or num_entries >= max_entries:
+                    # don't bother listing the rest of this level, but keep going deeper if we've still got total budget
+                    _logger.debug("Breadth-first walk of {} ran out of budget after {:d} entries.".format(self.current_search_dir, num_entries))
+                    with self.state_lock:
+                        self.candidate_computation_truncated = True
+                    break
 
-            # add all subdirectories (which are rooted at git_root_dir)
-            # ...note that we can't just split on " " because the first character is either a space or a -
-            for submodule in self._get_shell_output("cd {} && git submodule status --recursive | cut -b43- | cut --delim=' ' -f1".format(self.git_root_dir)).split():
-                _logger.debug("Found submodule: {}".format(submodule))
-                submodule_root = os.path.join(self.git_root_dir, submodule)
-                if submodule_root.startswith(self.current_search_dir):
-                    search_dirs.append(submodule_root)
+                try:
+                    names = os.listdir(dirname)
+                except OSError:
+                    continue
 
-            for search_dir in search_dirs:
-                for shell_cmd in (
-                        "git ls-files --cached",
-                        "git ls-files --exclude-standard --others"):
-                    append_batched_filenames("cd {} && {}".format(search_dir, shell_cmd), base_dir=search_dir, shell=True, add_dirnames=get_config("include_directories"))
+                if read_ignore_files:
+                    rules_chain = ignore.extend_rules_chain(rules_chain, dirname, names)
 
-        else:
-            # return all files in the current_search_dir
-            find_cmd = ["find", "-L", self.current_search_dir]
-            if not get_config("find_hidden_directories"):
-                find_cmd += ["-not", "-path", "*/.*/*"]
-            if not get_config("find_hidden_files"):
-                find_cmd += ["-not", "-name", ".*"]
+                for name_idx, name in enumerate(names):
+                    # a single huge directory can't blow through the budgets (or keep us from being interrupted) either
+                    if name_idx % BATCH_SIZE == 0 and self._interrupted():
+                        raise ComputationInterruptedException("Interrupted while walking {}".format(dirname))
+                    if num_level_entries >= max_entries_per_level or num_entries >= max_entries:
+                        _logger.debug("Breadth-first walk of {} ran out of budget in {}.".format(self.current_search_dir, dirname))
+                        with self.state_lock:
+                            self.candidate_computation_truncated = True
+                        break
 
-            if get_config("include_directories"):
-                append_batched_filenames(find_cmd + ["-type", "d"])
-            append_batched_filenames(find_cmd + ["-type", "f"])
+                    path = os.path.join(dirname, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue # broken symlink or a file that went away
+
+                    is_hidden = name.startswith(".")
+                    is_dir = stat.S_ISDIR(st.st_mode)
+                    if rules_chain and ignore.is_ignored(rules_chain, path, is_dir):
+                        continue
+
+                    if is_dir:
+                        dir_key = (st.st_dev, st.st_ino)
+                        if dir_key in parent_dirs:
+                            pass # symlink cycle, so list it but don't walk it again
+                        elif (not is_hidden or find_hidden_directories) and (not same_filesystem or st.st_dev == root_stat.st_dev):
+                            next_level.append((path, rules_chain, parent_dirs.union([ dir_key ])))
+                        if not include_directories:
+                            continue
+
+                    if is_hidden and not find_hidden_files:
+                        continue
+
+                    batch.add(path)
+                    num_entries += 1
+                    num_level_entries += 1
+                    if len(batch) >= BATCH_SIZE:
+                        self._add_candidates(batch)
+                        batch = set()
+
+            if batch:
+                self._add_candidates(batch)
+                batch = set()
+            level = next_level
+
+        if level:
+            # we stopped with directories left to walk
+            with self.state_lock:
+                self.candidate_computation_truncated = True
 
     def update_input_str(self, input_str):
         """ Determines the appropriate directory and queues a recompute of eligible files matching the input string. """
@@ -199,9 +699,10 @@ class FilenameCollectionThread(threading.Thread):
         """ Get all the relevant filenames given the input string, whether we're done computing them or not. """
 
         with self.state_lock:
-            candidate_fns = copy.copy(self.candidate_fns)
+            candidate_fns = CandidateSnapshot(self.candidate_list, len(self.candidate_list), self.candidate_fns) if self.candidate_fns is not UNINITIALIZED else UNINITIALIZED
             candidate_computation_complete = self.candidate_computation_complete
             git_root_dir = self.git_root_dir
+            candidate_computation_truncated = self.candidate_computation_truncated
             current_search_dir = self.current_search_dir
 
-        return CurrentFilenames(candidates=candidate_fns, candidate_computation_complete=candidate_computation_complete, git_root_dir=git_root_dir, current_search_dir=current_search_dir)
+        return CurrentFilenames(candidates=candidate_fns, candidate_computation_complete=candidate_computation_complete, candidate_computation_truncated=candidate_computation_truncated, git_root_dir=git_root_dir, current_search_dir=current_search_dir)
@@ -1,12 +1,20 @@
 import curses
 import logging
 import os
+import signal
 import time
 
 from contextlib import contextmanager
 
-from .collection import FilenameCollectionThread
+from .collection import CommandSource, FileListSource, FilenameCollectionThread, StdinSource
+from .content import CONTENT_QUERY_PREFIX, MIN_QUERY_LENGTH, ContentSearchThread
+from .history import FrecencyStore
+from .index import EligibleFile, EligibleFilenames
+from .matching import MATCH_FUZZY, MATCH_MODES, parse_match_mode
+from .preview import PreviewThread
+from .profiler import register_thread, stop_profiler, toggle_profiler
 from .search import SearchThread
+from .utils import cached_isdir, cached_relpath, get_config, split_search_dir_and_query
 
 _logger = logging.getLogger(__name__)
 
@@ -14,6 +22,8 @@ HIGHLIGHT_COLOR_PAIR = 1
 STATUS_BAR_COLOR_PAIR = 2
 NEWLINE = "^J"
 TAB = "^I"
+TOGGLE_PREVIEW = "^P"
+CYCLE_MATCH_MODE = "^R"
 def init_screen():
     screen = curses.initscr()
     curses.start_color()
@@ -52,24 +62,67 @@ def _common_suffix(path_one, path_two):
     rprefix = os.path.commonprefix((rpath_one, rpath_two))
     return rstr(rprefix)
 
+TAB_WIDTH = PreviewThread.TAB_WIDTH
+def _get_display_line(line, match_positions, width):
+    """ Returns a content match's line and match positions, ready to draw in width columns.
+
+    Tabs are expanded, other control characters are dropped, and the line is clipped to a window around the match.
+    """
+    # lines can be huge (e.g. minified files), so only look at the part near the match
+    raw_start = max(match_positions[0] - width, 0) if match_positions else 0
+    chars = []
+    display_positions = {}          # position in line -> position in chars
+    for pos in xrange(raw_start, min(len(line), raw_start + 3 * width)):
+        ch = line[pos]
+        display_positions[pos] = len(chars)
+        if ch == "\t":
+            chars.extend(" " * (TAB_WIDTH - len(chars) % TAB_WIDTH))
+        elif ch >= " " and ch != "\x7f":
+            chars.append(ch)
+    display_line = "".join(chars)
+    display_match_positions = [ display_positions[pos] for pos in match_positions if pos in display_positions ]
+
+    # show as much as we can before the match, as long as all of it fits
+    offset = 0
+    if display_match_positions and display_match_positions[-1] >= width:
+        offset = min(display_match_positions[-1] + 1 - width, max(display_match_positions[0] - width // 4, 0))
+    return display_line[offset:offset + width], [ pos - offset for pos in display_match_positions if 0 <= pos - offset < width ]
+
 @contextmanager
 def umask(newmask):
     oldmask = os.umask(newmask)
     yield
     os.umask(oldmask)
 
-def select_filename(screen, fn_collection_thread, search_thread, input_str, output_script):
-    highlighted_pos = 0
+def select_filename(screen, fn_collection_thread, extra_collection_threads, search_thread, content_thread, preview_thread, frecency_store, input_str, output_script):
+    highlighted_pos = 0         # rank of the highlighted filename among all eligible filenames
+    scroll_offset = 0           # rank of the first filename on the screen
+    num_eligible = 0
     key_name = None
+    show_preview = get_config("show_preview", False)
+    match_mode = get_config("match_mode", MATCH_FUZZY)   # for queries that don't start with a match mode prefix
 
     search_status = SearchStatus()
 
-    def get_display_uuid(input_str, curr_fns, eligible_fns):
+    def get_display_uuid(input_str, match_mode, curr_fns, extra_fns, eligible_fns, preview):
         """ Returns a unique id to represent what we're currently displaying on the screen.  Useful for us to block if we're not showing anything new. """
         return hash("".join(map(str,[
-            input_str,
+            input_str, match_mode, preview is not None and preview.abs_fn,
             curr_fns.candidate_computation_complete, curr_fns.current_search_dir, len(curr_fns.candidates),
-            eligible_fns.search_complete, len(eligible_fns.eligible) ])))
+            [ (fns.candidate_computation_complete, len(fns.candidates)) for fns in extra_fns ],
+            eligible_fns.search_complete, eligible_fns.num_eligible ])))
+
+    def remember_selection(abs_fn, search_dirs):
+        """ Records abs_fn in the frecency store under whichever search directory it came from.  Never worth failing over. """
+        if abs_fn is None:
+            return
+        for search_dir in search_dirs:
+            if abs_fn.startswith(os.path.join(search_dir, "")):
+                try:
+                    frecency_store.record(search_dir, abs_fn)
+                except (IOError, OSError) as e:
+                    _logger.debug("Couldn't record selection of {}: {}".format(abs_fn, e))
+                return
 
     def ensure_threads_alive(*threads):
         for th in threads:
@@ -78,34 +131,77 @@ def select_filename(screen, fn_collection_thread, search_thread, input_str, outp
 
     prev_display_uuid = None
     while True:
-        ensure_threads_alive(fn_collection_thread, search_thread)
+        ensure_threads_alive(fn_collection_thread, search_thread, content_thread, preview_thread, *extra_collection_threads)
 
         screen.clear()
 
         fn_collection_thread.update_input_str(input_str)
         curr_fns = fn_collection_thread.get_current_filenames()
 
-        search_thread.update_input(input_str, curr_fns)
-        eligible_fns = search_thread.get_eligible_filenames()
-
-        if not eligible_fns.search_complete:
-            highlighted_pos = 0
+        # extra search roots only join in when we're searching the current directory
+        cwd = os.getcwd()
+        if curr_fns.current_search_dir == cwd:
+            extra_fns = [ th.get_current_filenames() for th in extra_collection_threads if th.state_is_consistent() ]
+        else:
+            extra_fns = []
+        candidates_complete = curr_fns.candidate_computation_complete and all( fns.candidate_computation_complete for fns in extra_fns )
 
         STATUS_BAR_Y = 0      # status bar first!
         INPUT_Y = 2           # where the input line should go
         FN_OFFSET = 3         # first Y coordinate of a filename
         max_height, max_width = screen.getmaxyx()
-        max_files_to_show = min(len(eligible_fns.eligible), max_height - FN_OFFSET)
+        list_width = max_width // 2 if show_preview else max_width # the preview pane takes the right half
+
+        # queries starting with CONTENT_QUERY_PREFIX search file contents instead of filenames
+        _, query_str = split_search_dir_and_query(input_str)
+        content_query = query_str[len(CONTENT_QUERY_PREFIX):] if query_str.startswith(CONTENT_QUERY_PREFIX) else None
+
+        if content_query is None:
+            search_thread.update_input(input_str, curr_fns, extra_fns, match_mode)
+        else:
+            content_thread.update_query(content_query, curr_fns)
+
+        def get_window(offset, limit):
+            """ Only fetch what fits on the screen. """
+            if content_query is None:
+                return search_thread.get_eligible_filenames(offset=offset, limit=limit), None
+
+            content_matches = content_thread.get_matches(offset=offset, limit=limit)
+            return EligibleFilenames(
+                    eligible=[ EligibleFile(abs_fn=match.abs_fn, abs_match_positions=[]) for match in content_matches.matches ],
+                    num_eligible=content_matches.num_matches,
+                    search_complete=content_matches.search_complete), content_matches
+
+        # scroll just enough to keep the highlighted filename on the screen
+        num_rows = max(max_height - FN_OFFSET, 1)
+        def scroll_to(highlighted_pos, scroll_offset):
+            return min(max(scroll_offset, highlighted_pos - num_rows + 1), highlighted_pos)
+
+        scroll_offset = scroll_to(highlighted_pos, scroll_offset)
+        eligible_fns, content_matches = get_window(scroll_offset, num_rows)
+
+        # don't point past the end if there are fewer results than there used to be
+        # (new input starts back at the top when it's typed, but more candidates coming in shouldn't move us)
+        clamped_pos = min(highlighted_pos, max(eligible_fns.num_eligible - 1, 0))
+        if clamped_pos != highlighted_pos:
+            highlighted_pos = clamped_pos
+            scroll_offset = scroll_to(highlighted_pos, scroll_offset)
+            eligible_fns, content_matches = get_window(scroll_offset, num_rows)
+        num_eligible = eligible_fns.num_eligible
 
         def addstr(y, x, s, attr):
             if s:
                 _logger.debug("adding string '{}'".format(s))
                 screen.addstr(y, x, s, attr)
 
-        def add_line(y, x, line, attr, fill_line=False, bold_positions=None):
-            s = line[-(max_width - 1):]
+        def add_line(y, x, line, attr, fill_line=False, bold_positions=None, width=None):
+            width = width or max_width
+            s = line[-(width - 1):]
+            if bold_positions is not None:
+                # we've cut off the start of anything that's too long
+                bold_positions = [ pos - (len(line) - len(s)) for pos in bold_positions if 0 <= pos - (len(line) - len(s)) < len(s) ]
             if fill_line:
-                s = s.ljust(max_width - 1, " ")
+                s = s.ljust(width - 1, " ")
             try:
                 if bold_positions is None:
                     addstr(y, x, s, attr)
@@ -131,28 +227,50 @@ def select_filename(screen, fn_collection_thread, search_thread, input_str, outp
             except Exception:
                 _logger.debug("Couldn't add string to screen: {}".format(s))
 
-        if (not eligible_fns.search_complete or not curr_fns.candidate_computation_complete):
+        if (not eligible_fns.search_complete or not candidates_complete):
             search_status_prefix = "{} ".format(search_status.get_next_status_char())
         else:
             search_status_prefix = "  "
             search_status.reset_status()
 
         # add status bar
-        status_text = "{}{:d} of {:d} candidate filenames -- {}".format(
-                search_status_prefix,
-                len(eligible_fns.eligible),
-                len(curr_fns.candidates),
-                "{}{}".format(curr_fns.current_search_dir, " (git)" if curr_fns.git_root_dir is not None else ""))
+        if content_matches is not None and len(content_query) < MIN_QUERY_LENGTH:
+            status_text = "{}type at least {:d} characters to search file contents -- {}".format(
+                    search_status_prefix,
+                    MIN_QUERY_LENGTH,
+                    curr_fns.current_search_dir)
+        elif content_matches is not None:
+            status_text = "{}{:d} files containing '{}' ({:d} of {:d} candidate filenames indexed) -- {}".format(
+                    search_status_prefix,
+                    content_matches.num_matches,
+                    content_query,
+                    content_matches.num_indexed,
+                    content_matches.num_candidates,
+                    curr_fns.current_search_dir)
+        else:
+            query_match_mode, _ = parse_match_mode(query_str, match_mode)
+            status_text = "{}{}{:d} of {:d}{} candidate filenames -- {}{}".format(
+                    search_status_prefix,
+                    "[{}] ".format(query_match_mode) if query_match_mode != MATCH_FUZZY else "",
+                    eligible_fns.num_eligible,
+                    len(curr_fns.candidates) + sum( len(fns.candidates) for fns in extra_fns ),
+                    " (budget reached)" if curr_fns.candidate_computation_truncated else "",
+                    "{}{}".format(curr_fns.current_search_dir, " (git)" if curr_fns.git_root_dir is not None else ""),
+                    "".join( " + {} ({:d}{}{})".format(
+                        fns.current_search_dir,
+                        len(fns.candidates),
+                        "" if fns.candidate_computation_complete else "...",
+                        ", git" if fns.git_root_dir is not None else "") for fns in extra_fns ))
         add_line(STATUS_BAR_Y, 0, status_text, curses.color_pair(STATUS_BAR_COLOR_PAIR) | curses.A_BOLD, fill_line=True)
 
         # input line
         add_line(INPUT_Y, 0, input_str, curses.A_UNDERLINE, fill_line=True)
 
-        cwd = os.getcwd()
         def get_display_fn_match_positions(eligible_fn):
-            if (curr_fns.current_search_dir.startswith(cwd)
-                    or (curr_fns.git_root_dir is not None and cwd.startswith(curr_fns.git_root_dir))):
-                display_fn = os.path.relpath(eligible_fn.abs_fn)
+            if (eligible_fn.abs_fn.startswith(curr_fns.current_search_dir)
+                    and (curr_fns.current_search_dir.startswith(cwd)
+                        or (curr_fns.git_root_dir is not None and cwd.startswith(curr_fns.git_root_dir)))):
+                display_fn = cached_relpath(eligible_fn.abs_fn)
                 # recompute our match positions
                 common_suffix = _common_suffix(display_fn, eligible_fn.abs_fn)
                 abs_prefix = eligible_fn.abs_fn[:-len(common_suffix)]
@@ -162,29 +280,45 @@ def select_filename(screen, fn_collection_thread, search_thread, input_str, outp
                 display_fn = eligible_fn.abs_fn
                 match_positions = eligible_fn.abs_match_positions
 
-            if not display_fn.endswith("/") and os.path.isdir(display_fn):
+            if not display_fn.endswith("/") and cached_isdir(eligible_fn.abs_fn):
                 display_fn += "/"
 
             return display_fn, match_positions
 
         highlighted_fn = None
-        screen_pos = 0
-        for eligible_fn in eligible_fns.eligible:
-            if screen_pos >= max_files_to_show:
-                break
-
-            if eligible_fn.abs_fn == curr_fns.current_search_dir:
-                continue
-
+        highlighted_abs_fn = None
+        for screen_pos, eligible_fn in enumerate(eligible_fns.eligible):
             display_fn, match_positions = get_display_fn_match_positions(eligible_fn)
-            if screen_pos == highlighted_pos:
+            if scroll_offset + screen_pos == highlighted_pos:
                 attr = curses.color_pair(HIGHLIGHT_COLOR_PAIR)
                 highlighted_fn = display_fn
+                highlighted_abs_fn = eligible_fn.abs_fn
             else:
                 attr = curses.A_NORMAL
 
-            add_line(FN_OFFSET + screen_pos, 0, display_fn, attr, bold_positions=match_positions)
-            screen_pos += 1
+            display_line = display_fn
+            if content_matches is not None:
+                # show the matching line as context
+                match = content_matches.matches[screen_pos]
+                display_line = "{}:{:d}: ".format(display_fn, match.line_num)
+                line, line_match_positions = _get_display_line(match.line, match.line_match_positions, max(list_width - 1 - len(display_line), 1))
+                match_positions = [ len(display_line) + pos for pos in line_match_positions ]
+                display_line += line
+
+            add_line(FN_OFFSET + screen_pos, 0, display_line, attr, bold_positions=match_positions, width=list_width)
+
+        # the preview is read in the background, so we just show whatever's ready
+        preview = None
+        if show_preview and highlighted_abs_fn is not None:
+            preview_thread.request(highlighted_abs_fn)
+            preview = preview_thread.get_preview(highlighted_abs_fn)
+            preview_lines = preview.lines if preview is not None else [ "..." ]
+            for preview_y, preview_line in enumerate(preview_lines[:max_height - FN_OFFSET]):
+                try:
+                    addstr(FN_OFFSET + preview_y, list_width + 1, preview_line[:max_width - list_width - 2], curses.A_DIM)
+                except Exception:
+                    _logger.debug("Couldn't add preview line to screen: {}".format(preview_line))
+        preview_pending = show_preview and highlighted_abs_fn is not None and preview is None
 
         screen.refresh()
 
@@ -192,8 +326,8 @@ def select_filename(screen, fn_collection_thread, search_thread, input_str, outp
         input_x = min(len(input_str), max_width - 1)
 
         # getch is nonblocking; try in 20ms increments for up to 120ms before redrawing screen (60s if we know the screen won't change without input)
-        new_display_uuid = get_display_uuid(input_str, curr_fns, eligible_fns)
-        getch_time = 60 if new_display_uuid == prev_display_uuid and curr_fns.candidate_computation_complete and eligible_fns.search_complete else 0.120
+        new_display_uuid = get_display_uuid(input_str, match_mode, curr_fns, extra_fns, eligible_fns, preview)
+        getch_time = 60 if new_display_uuid == prev_display_uuid and candidates_complete and eligible_fns.search_complete and not preview_pending else 0.120
         prev_display_uuid = new_display_uuid
 
         start_getch = time.time()
@@ -211,33 +345,44 @@ def select_filename(screen, fn_collection_thread, search_thread, input_str, outp
         if key_name == NEWLINE:
             # open the file in $EDITOR
             open_file(highlighted_fn, output_script)
+            remember_selection(highlighted_abs_fn, [ fns.current_search_dir for fns in [ curr_fns ] + extra_fns ])
             return
         elif key_name == TAB:
             # dump the character back to the prompt
             dump_to_prompt(highlighted_fn, output_script)
+            remember_selection(highlighted_abs_fn, [ fns.current_search_dir for fns in [ curr_fns ] + extra_fns ])
             return
 
         elif key_name == "KEY_DOWN":
-            highlighted_pos = min(highlighted_pos + 1, max_files_to_show - 1)
+            highlighted_pos = min(highlighted_pos + 1, max(num_eligible - 1, 0))
         elif key_name == "KEY_UP":
             highlighted_pos = max(highlighted_pos - 1, 0)
         elif key_name == "KEY_NPAGE": # page down
-            highlighted_pos = max_files_to_show - 1
+            highlighted_pos = min(highlighted_pos + num_rows, max(num_eligible - 1, 0))
         elif key_name == "KEY_PPAGE": # page up
+            highlighted_pos = max(highlighted_pos - num_rows, 0)
+        elif key_name == "KEY_HOME":
             highlighted_pos = 0
+        elif key_name == "KEY_END":
+            highlighted_pos = max(num_eligible - 1, 0)
+        elif key_name == TOGGLE_PREVIEW:
+            show_preview = not show_preview
+        elif key_name == CYCLE_MATCH_MODE:
+            match_mode = MATCH_MODES[(MATCH_MODES.index(match_mode) + 1) % len(MATCH_MODES)]
+            highlighted_pos = scroll_offset = 0
         else:
             if key_name in ["KEY_BACKSPACE", "^?"]:   # delete single character
                 input_str = input_str[:-1]
             elif key_name == "^W":                    # delete whole line
                 input_str = ""
             elif (key_name.startswith("KEY_")
-                    or key_name.startswith("^")):     # just ignore it
+                    or (key_name.startswith("^") and len(key_name) > 1)): # just ignore it (but a plain ^ is a match mode prefix)
                 continue
             else:                                     # add character (doesn't special key checking)
                 input_str += key_name
 
             # at this point, input_str has changed, so reset the highlighted_pos
-            highlighted_pos = 0
+            highlighted_pos = scroll_offset = 0
 
     # something's definitely not right
     raise Exception("Should be unreachable.  Exit this function within the loop!")
@@ -272,6 +417,43 @@ def get_initial_input_str():
     """
     return ""
 
+def get_extra_search_roots():
+    """ Returns the configured search roots that should be searched along with the current directory (skipping any that overlap it). """
+    cwd = os.getcwd()
+    def overlaps(root):
+        return root == cwd or cwd.startswith(root.rstrip("/") + "/") or root.startswith(cwd + "/")
+
+    roots = []
+    for root in get_config("search_roots", []):
+        root = os.path.abspath(os.path.expanduser(root))
+        if os.path.isdir(root) and not overlaps(root) and root not in roots:
+            roots.append(root)
+    return roots
+
+def get_candidate_source():
+    """ Returns the CandidateSource to collect filenames from instead of git or the filesystem, if any.
+
+    Filenames piped to us on stdin win, then the candidate_command config and then the candidate_file_list config.
+    """
+    import sys
+    if not sys.stdin.isatty():
+        # keep reading the pipe from another fd, and give curses the terminal as its stdin
+        stdin = os.fdopen(os.dup(sys.stdin.fileno()), "rb")
+        tty_fd = os.open("/dev/tty", os.O_RDONLY)
+        os.dup2(tty_fd, sys.stdin.fileno())
+        os.close(tty_fd)
+        return StdinSource(stdin, os.getcwd())
+
+    candidate_command = get_config("candidate_command", None)
+    if candidate_command:
+        return CommandSource(candidate_command)
+
+    candidate_file_list = get_config("candidate_file_list", None)
+    if candidate_file_list:
+        return FileListSource(os.path.abspath(os.path.expanduser(candidate_file_list)), os.getcwd())
+
+    return None
+
 def run_loop():
     import sys
     if len(sys.argv) == 2:
@@ -280,40 +462,64 @@ def run_loop():
         print >> sys.stderr, "usage: completeme output-script-file"
         raise SystemExit()
 
+    # kill -USR1 <pid> starts sampling all our threads; the next one stops and writes the report to profile_dir
+    register_thread()
+    profile_dir = os.path.expanduser(get_config("profile_dir", "~/.cache/completeme/profiles"))
+    signal.signal(signal.SIGUSR1, lambda signum, frame: toggle_profiler(profile_dir))
+    if os.environ.get("RUN_PROFILER"):
+        toggle_profiler(profile_dir)
+
     initial_input_str = get_initial_input_str()
-    fn_collection_thread = FilenameCollectionThread(initial_input_str)
+    fn_collection_thread = FilenameCollectionThread(initial_input_str, get_candidate_source())
     fn_collection_thread.start()
 
     while not fn_collection_thread.state_is_consistent():
         time.sleep(0.002)
 
-    search_thread = SearchThread(initial_input_str, fn_collection_thread.get_current_filenames())
+    # one collection thread per extra search root, each with its own cache and git detection
+    extra_collection_threads = [ FilenameCollectionThread(os.path.join(root, "")) for root in get_extra_search_roots() ]
+    for th in extra_collection_threads:
+        th.start()
+
+    # files picked from here before are searched right away, before we've collected anything
+    frecency_store = FrecencyStore(os.path.expanduser(get_config("history_file", "~/.cache/completeme/history.json")), get_config("history_max_entries", 500))
+
+    search_thread = SearchThread(initial_input_str, fn_collection_thread.get_current_filenames(), frecency_store=frecency_store)
     search_thread.start()
 
+    content_thread = ContentSearchThread()
+    content_thread.start()
+
+    preview_thread = PreviewThread()
+    preview_thread.start()
+
     try:
         screen = init_screen()
-        select_filename(screen, fn_collection_thread, search_thread, initial_input_str, output_script)
+        select_filename(screen, fn_collection_thread, extra_collection_threads, search_thread, content_thread, preview_thread, frecency_store, initial_input_str, output_script)
     except KeyboardInterrupt:
         pass
     finally:
+        # report on everything while it's all still running
+        stop_profiler()
+
         fn_collection_thread.stop()
         search_thread.stop()
+        content_thread.stop()
+        preview_thread.stop()
+        for th in extra_collection_threads:
+            th.stop()
 
         cleanup_curses()
 
         search_thread.join()
+        content_thread.join()
+        preview_thread.join()
         fn_collection_thread.join()
+        for th in extra_collection_threads:
+            th.join()
 
 def main():
     logging.basicConfig(level=logging.DEBUG if os.environ.get("DEBUG") else logging.ERROR,
             format="%(asctime)s: %(message)s",
             datefmt="%Y-%m-%d %H:%M:%S")
-    if os.environ.get("RUN_PROFILER"):
-        import cProfile
-        import pstats
-        import tempfile
-        _, profile_fn = tempfile.mkstemp()
-        cProfile.run("run_loop()", profile_fn)
-        pstats.Stats(profile_fn).sort_stats("cumulative").print_stats()
-    else:
-        run_loop()
+    run_loop()
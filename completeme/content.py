@@ -0,0 +1,513 @@
+import array
+import collections
+import hashlib
+import json
+import logging
+import mmap
+import os
+import Queue
+import re
+import stat
+import struct
+import threading
+import time
+import traceback
+
+from .collection import CandidateSnapshot
+from .profiler import InstrumentedLock, register_thread
+from .utils import ComputationInterruptedException, get_config
+
+_logger = logging.getLogger(__name__)
+
+CONTENT_QUERY_PREFIX = "#"      # queries starting with this search file contents instead of filenames
+MIN_QUERY_LENGTH = 3            # we need at least one trigram to use the index
+
+_TRIGRAM_RE = re.compile(r"(?=(...))", re.DOTALL)
+def _get_trigrams(lowered_data):
+    """ Returns the set of all (overlapping) three-byte substrings of lowered_data. """
+    return set(_TRIGRAM_RE.findall(lowered_data))
+
+def _is_binary(data):
+    """ Cheap check for binary data: any NUL byte in the first few kilobytes. """
+    return "\0" in data[:8192]
+
+class TrigramIndex(object):
+    """ A persistent trigram index over the contents of a set of files.
+
+    On disk, the index is a header, a JSON file table, one big array of file ids and a sorted trigram table pointing
+    into that array.  It's memory-mapped and binary-searched for queries.  Files indexed since the last save() are kept
+    in memory and merged in (trigram by trigram, in one pass over the old index) on the next save().
+
+    File ids index into self.files, whose entries are [ abs_fn, mtime, size ].  Files that changed since they were
+    indexed on disk are marked stale and re-added under a new id.  Stale (and deleted) files are saved as nulls until
+    there are enough of them to be worth renumbering everything.
+    """
+    MAGIC = "CMTRIGR2"
+    HEADER = struct.Struct("<8sQQQ")    # magic, length of the JSON file table, number of file ids in the postings, number of trigrams
+    TABLE_ENTRY = struct.Struct("<3sII") # trigram, index of its first file id in the postings, number of file ids
+    MAX_STALE_FRACTION = 0.25           # renumber the files when more of them than this are stale
+
+    def __init__(self, index_fn):
+        super(TrigramIndex, self).__init__()
+        self.index_fn = index_fn
+
+        self.files = []
+        self.file_ids = {}                              # abs_fn -> current file id
+        self.stale_ids = set()
+
+        self.mm = None
+        self.num_disk_files = 0
+        self.num_disk_trigrams = 0
+        self.table_offset = None
+        self.postings_offset = None
+
+        self.memory_postings = collections.defaultdict(lambda: array.array("I")) # trigram -> file ids indexed since we last saved (in order)
+        self.num_unsaved = 0
+
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_fn, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError): # ValueError: can't mmap an empty file
+            return
+
+        try:
+            magic, files_len, num_postings, num_trigrams = self.HEADER.unpack_from(mm, 0)
+            if magic != self.MAGIC:
+                raise ValueError("Bad magic: {!r}".format(magic))
+            files = json.loads(mm[self.HEADER.size:self.HEADER.size + files_len])
+        except (struct.error, ValueError):
+            _logger.debug("Ignoring unreadable content index {}".format(self.index_fn))
+            mm.close()
+            return
+
+        for file_id, entry in enumerate(files):
+            if entry is None:
+                self.stale_ids.add(file_id)
+            else:
+                entry[0] = entry[0].encode("utf-8") # we're dealing in byte strings
+                self.file_ids[entry[0]] = file_id
+        self.files = files
+        self.mm = mm
+        self.num_disk_files = len(files)
+        self.num_disk_trigrams = num_trigrams
+        self.postings_offset = self.HEADER.size + files_len
+        self.table_offset = self.postings_offset + num_postings * array.array("I").itemsize
+        _logger.debug("Loaded content index {} with {:d} files and {:d} trigrams.".format(self.index_fn, len(files), num_trigrams))
+
+    def _get_disk_table_entry(self, idx):
+        return self.TABLE_ENTRY.unpack_from(self.mm, self.table_offset + idx * self.TABLE_ENTRY.size)
+
+    def _get_disk_postings_data(self, start, count):
+        """ Returns the raw (native uint32) file ids for a trigram table entry. """
+        itemsize = array.array("I").itemsize
+        begin = self.postings_offset + start * itemsize
+        return self.mm[begin:begin + count * itemsize]
+
+    def _get_disk_postings(self, trigram):
+        """ Binary searches the on-disk trigram table for the file ids containing trigram. """
+        lo, hi = 0, self.num_disk_trigrams
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_trigram, start, count = self._get_disk_table_entry(mid)
+            if mid_trigram < trigram:
+                lo = mid + 1
+            elif mid_trigram > trigram:
+                hi = mid
+            else:
+                postings = array.array("I")
+                postings.fromstring(self._get_disk_postings_data(start, count))
+                return postings
+        return ()
+
+    def is_current(self, abs_fn, st):
+        """ Returns whether abs_fn has already been indexed as it is now. """
+        file_id = self.file_ids.get(abs_fn)
+        if file_id is None:
+            return False
+        _, mtime, size = self.files[file_id]
+        return mtime == st.st_mtime and size == st.st_size
+
+    def add_file(self, abs_fn, st, trigrams):
+        """ (Re-)indexes abs_fn.  Binary and huge files are added without any trigrams so we remember not to read them again. """
+        self.remove_file(abs_fn)
+
+        file_id = len(self.files)
+        self.files.append([ abs_fn, st.st_mtime, st.st_size ])
+        self.file_ids[abs_fn] = file_id
+        for trigram in trigrams:
+            # (ids only ever go up, so each trigram's stay sorted)
+            self.memory_postings[trigram].append(file_id)
+        self.num_unsaved += 1
+
+    def remove_file(self, abs_fn):
+        """ Forgets about abs_fn, e.g. because it's been deleted. """
+        file_id = self.file_ids.pop(abs_fn, None)
+        if file_id is not None:
+            self.stale_ids.add(file_id)
+            self.num_unsaved += 1
+
+    def remove_missing_files(self):
+        """ Forgets about every indexed file that's no longer there. """
+        for abs_fn in self.file_ids.keys():
+            if not os.path.isfile(abs_fn):
+                self.remove_file(abs_fn)
+
+    def needs_save(self, min_unsaved):
+        """ Returns whether we've indexed enough to be worth saving: at least min_unsaved files, and at least a quarter as many as are on disk (so that saving as we go takes linear time overall). """
+        return self.num_unsaved >= max(min_unsaved, self.num_disk_files // 4)
+
+    def get_candidate_files(self, trigrams):
+        """ Returns the filenames that contain all of trigrams (and maybe the query they came from). """
+        file_ids = None
+        for trigram in trigrams:
+            ids = set(self._get_disk_postings(trigram)) if self.mm is not None else set()
+            ids.update(self.memory_postings.get(trigram, ()))
+            # a file that's been reindexed (even since we last saved) is only found under its latest id
+            ids.difference_update(self.stale_ids)
+
+            file_ids = ids if file_ids is None else file_ids.intersection(ids)
+            if not file_ids:
+                return []
+        return [ self.files[file_id][0] for file_id in sorted(file_ids or ()) ]
+
+    def _iter_merged_postings(self):
+        """ Yields (trigram, start, count, memory file ids) for every trigram on disk or in memory, in order.  start and count are for the disk postings (0 if there aren't any). """
+        memory_trigrams = sorted(self.memory_postings)
+        memory_idx = 0
+        for idx in xrange(self.num_disk_trigrams):
+            trigram, start, count = self._get_disk_table_entry(idx)
+            while memory_idx < len(memory_trigrams) and memory_trigrams[memory_idx] < trigram:
+                yield memory_trigrams[memory_idx], 0, 0, self.memory_postings[memory_trigrams[memory_idx]]
+                memory_idx += 1
+
+            memory_ids = ()
+            if memory_idx < len(memory_trigrams) and memory_trigrams[memory_idx] == trigram:
+                memory_ids = self.memory_postings[trigram]
+                memory_idx += 1
+            yield trigram, start, count, memory_ids
+
+        for trigram in memory_trigrams[memory_idx:]:
+            yield trigram, 0, 0, self.memory_postings[trigram]
+
+    def save(self):
+        """ Merges everything we've indexed since the last save into a new index file and maps that instead. """
+        if not self.num_unsaved:
+            return
+
+        if len(self.stale_ids) > len(self.files) * self.MAX_STALE_FRACTION:
+            # renumber everything that isn't stale (which keeps each trigram's file ids in order)
+            new_ids = array.array("l")
+            files = []
+            for file_id, entry in enumerate(self.files):
+                if file_id in self.stale_ids:
+                    new_ids.append(-1)
+                else:
+                    new_ids.append(len(files))
+                    files.append(entry)
+        else:
+            # leave the ids alone, so the postings on disk can be copied over as they are
+            new_ids = None
+            files = [ entry if file_id not in self.stale_ids else None for file_id, entry in enumerate(self.files) ]
+        files_json = json.dumps(files)
+
+        index_dir = os.path.dirname(self.index_fn)
+        if not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        tmp_fn = "{}.{:d}.tmp".format(self.index_fn, os.getpid())
+        table = []
+        num_postings = 0
+        with open(tmp_fn, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, 0, 0, 0)) # (filled in once we know how many postings we've got)
+            f.write(files_json)
+            for trigram, start, count, memory_ids in self._iter_merged_postings():
+                disk_data = self._get_disk_postings_data(start, count) if count else ""
+                if new_ids is None:
+                    data = disk_data + memory_ids.tostring() if memory_ids else disk_data
+                else:
+                    postings = array.array("I")
+                    postings.fromstring(disk_data)
+                    postings.extend(memory_ids)
+                    data = array.array("I", ( new_ids[file_id] for file_id in postings if new_ids[file_id] >= 0 )).tostring()
+                if data:
+                    num_trigram_postings = len(data) // array.array("I").itemsize
+                    table.append(self.TABLE_ENTRY.pack(trigram, num_postings, num_trigram_postings))
+                    num_postings += num_trigram_postings
+                    f.write(data)
+            f.write("".join(table))
+            f.seek(0)
+            f.write(self.HEADER.pack(self.MAGIC, len(files_json), num_postings, len(table)))
+        os.rename(tmp_fn, self.index_fn)
+        _logger.debug("Saved content index {} with {:d} files and {:d} trigrams.".format(self.index_fn, len(files), len(table)))
+
+        # start over from what we just wrote
+        self.close()
+        self.files, self.file_ids, self.stale_ids = [], {}, set()
+        self.memory_postings.clear()
+        self.num_unsaved = 0
+        self._load()
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+            self.num_disk_files = 0
+            self.num_disk_trigrams = 0
+
+ContentMatch = collections.namedtuple("ContentMatch", [ "abs_fn", "line_num", "line", "line_match_positions" ])
+ContentMatches = collections.namedtuple("ContentMatches", [ "matches", "num_matches", "search_complete", "num_indexed", "num_candidates" ])
+class ContentSearchThread(threading.Thread):
+    """ Indexes the contents of the candidate filenames in the background and answers content queries from that index.
+
+    Every candidate file is checked (and indexed if it's new or changed) once per search directory, and a new query
+    reads all the files the index says might match.  After that, only the files checked since are read and merged
+    into the matches.
+    """
+    NewQuery = collections.namedtuple("NewQuery", [ "query_str", "current_search_dir", "candidate_fns" ])
+
+    INDEX_BATCH_SIZE = 50       # files to index between checking for new queries
+    SAVE_EVERY = 2000           # files to index (at least) before merging them into the on-disk index
+
+    def __init__(self):
+        super(ContentSearchThread, self).__init__()
+        self.daemon = True
+        self.ex_traceback = None
+
+        self.input_queue = Queue.Queue()
+        self.state_lock = InstrumentedLock("ContentSearchThread.state_lock")
+        self.should_stop = False
+
+        self.query_str = None
+        self.current_search_dir = None
+        self.candidate_fns = None
+        self.latest_candidate_fns = None            # candidates collected since the query started, for us to pick up when we get to them
+        self.requested_query = None                 # the (query_str, current_search_dir) we last queued up
+        self.unchecked_fns = []                     # candidate filenames we haven't made sure are indexed yet
+        self.checked_fns = set()
+        self.index = None
+        self.removed_missing_files = False          # have we forgotten about deleted files in this index yet?
+
+        self.ranked = {}                            # abs_fn -> (rank key, abs_fn, ContentMatch) for the files that match the query
+        self.matches = []
+        self.search_complete = False
+        self.num_indexed = 0
+
+    def get_traceback(self):
+        """ Returns the traceback for the exception that killed this thread. """
+        return self.ex_traceback
+
+    def _interrupted(self):
+        return self.should_stop or not self.input_queue.empty()
+
+    def stop(self):
+        self.should_stop = True
+
+    @staticmethod
+    def _get_index_fn(search_dir):
+        index_dir = os.path.expanduser(get_config("content_index_dir", "~/.cache/completeme"))
+        return os.path.join(index_dir, "{}.trigrams".format(hashlib.md5(search_dir).hexdigest()))
+
+    def run(self):
+        try:
+            register_thread()
+            while True:
+                if self.should_stop:
+                    # don't hold up exiting by saving; whatever's unsaved gets reindexed next time
+                    return
+
+                if not self.input_queue.empty():
+                    with self.state_lock:
+                        while not self.input_queue.empty():
+                            next_input = self.input_queue.get()
+                        self._switch_input(next_input)
+                        self.search_complete = False
+                    recheck_fns = None
+
+                elif self.unchecked_fns:
+                    # just the files we've checked are new to the matches
+                    recheck_fns = self._index_batch()
+
+                elif self._add_latest_candidates():
+                    continue
+
+                else:
+                    # we're all caught up, so it's a good time to clean up and save
+                    if self.index is not None and not self.removed_missing_files:
+                        self.index.remove_missing_files()
+                        self.removed_missing_files = True
+                    if self.index is not None and self.index.num_unsaved:
+                        self.index.save()
+                    time.sleep(0.005)
+                    continue
+
+                try:
+                    self._compute_matches(recheck_fns)
+                except ComputationInterruptedException:
+                    _logger.debug("Content search interrupted!")
+                    continue
+
+                with self.state_lock:
+                    self.search_complete = self.input_queue.empty() and not self.unchecked_fns and self.latest_candidate_fns is None
+        except Exception:
+            self.ex_traceback = traceback.format_exc()
+            raise
+
+    def _switch_input(self, next_input):
+        if next_input.current_search_dir != self.current_search_dir:
+            if self.index is not None:
+                self.index.save()
+                self.index.close()
+            self.index = TrigramIndex(self._get_index_fn(next_input.current_search_dir))
+            self.removed_missing_files = False
+            self.checked_fns = set()
+            self.num_indexed = 0
+
+        self.query_str = next_input.query_str
+        self.current_search_dir = next_input.current_search_dir
+        self.candidate_fns = next_input.candidate_fns
+        self.latest_candidate_fns = None
+        self.unchecked_fns = list(next_input.candidate_fns.difference(self.checked_fns))
+
+    def _add_latest_candidates(self):
+        """ Queues up any candidates collected since we last looked to be checked.  Returns whether there were any. """
+        with self.state_lock:
+            latest_candidate_fns, self.latest_candidate_fns = self.latest_candidate_fns, None
+        if latest_candidate_fns is None:
+            return False
+
+        new_fns = latest_candidate_fns.get_added_since(self.candidate_fns) if isinstance(latest_candidate_fns, CandidateSnapshot) else None
+        if new_fns is None:
+            new_fns = latest_candidate_fns.difference(self.checked_fns)
+        with self.state_lock:
+            self.candidate_fns = latest_candidate_fns
+        self.unchecked_fns.extend( abs_fn for abs_fn in new_fns if abs_fn not in self.checked_fns )
+        return bool(self.unchecked_fns)
+
+    def _index_batch(self):
+        """ Makes sure the next few candidates are indexed.  Returns the ones we checked. """
+        max_file_size = get_config("content_index_max_file_size", 1024 * 1024)
+
+        batch, self.unchecked_fns = self.unchecked_fns[-self.INDEX_BATCH_SIZE:], self.unchecked_fns[:-self.INDEX_BATCH_SIZE]
+        for abs_fn in batch:
+            self.checked_fns.add(abs_fn)
+            try:
+                abs_fn.decode("utf-8") # the file table is JSON
+            except UnicodeDecodeError:
+                continue
+
+            try:
+                st = os.stat(abs_fn)
+            except OSError:
+                self.index.remove_file(abs_fn)
+                continue
+
+            try:
+                if not stat.S_ISREG(st.st_mode) or self.index.is_current(abs_fn, st):
+                    continue
+
+                trigrams = ()
+                if 0 < st.st_size <= max_file_size:
+                    with open(abs_fn, "rb") as f:
+                        data = f.read(max_file_size)
+                    if not _is_binary(data):
+                        trigrams = _get_trigrams(data.lower())
+            except (IOError, OSError):
+                continue
+
+            self.index.add_file(abs_fn, st, trigrams)
+
+        with self.state_lock:
+            self.num_indexed = len(self.checked_fns)
+
+        if self.index.needs_save(self.SAVE_EVERY):
+            self.index.save()
+        return batch
+
+    def _compute_matches(self, recheck_fns=None):
+        """ Finds candidate files that contain the query (ignoring case) and ranks them, most occurrences first.
+
+        If recheck_fns is given, only those files are (re)read, and merged into the matches we've already got.
+        """
+        lowered = self.query_str.lower()
+        if len(lowered) < MIN_QUERY_LENGTH:
+            ranked = {}
+        else:
+            max_file_size = get_config("content_index_max_file_size", 1024 * 1024)
+            candidate_files = self.index.get_candidate_files(_get_trigrams(lowered))
+            if recheck_fns is not None:
+                recheck_fns = set(recheck_fns)
+                candidate_files = [ abs_fn for abs_fn in candidate_files if abs_fn in recheck_fns ]
+
+            # the index only narrows things down, so double check each file (which also finds us the line to show)
+            new_ranked = {}
+            for idx, abs_fn in enumerate(candidate_files):
+                if idx % 10 == 0 and self._interrupted():
+                    raise ComputationInterruptedException("Content search interrupted!")
+
+                if abs_fn not in self.candidate_fns:
+                    continue
+                try:
+                    with open(abs_fn, "rb") as f:
+                        data = f.read(max_file_size)
+                except (IOError, OSError):
+                    continue
+
+                lowered_data = data.lower()
+                pos = lowered_data.find(lowered)
+                if pos == -1:
+                    continue
+
+                line_start = data.rfind("\n", 0, pos) + 1
+                line_end = data.find("\n", pos)
+                if line_end == -1:
+                    line_end = len(data)
+                line = data[line_start:line_end]
+                new_ranked[abs_fn] = (
+                    -lowered_data.count(lowered), abs_fn,
+                    ContentMatch(
+                        abs_fn=abs_fn,
+                        line_num=data.count("\n", 0, pos) + 1,
+                        line=line,
+                        line_match_positions=range(pos - line_start, pos - line_start + len(lowered)))
+                    )
+
+            if recheck_fns is not None:
+                ranked = dict( (abs_fn, ranked_match) for abs_fn, ranked_match in self.ranked.iteritems() if abs_fn not in recheck_fns )
+                ranked.update(new_ranked)
+            else:
+                ranked = new_ranked
+
+        matches = [ match for _, _, match in sorted(ranked.itervalues()) ]
+        self.ranked = ranked
+        with self.state_lock:
+            self.matches = matches
+
+    def update_query(self, query_str, current_filenames):
+        """ Queue up a content search for query_str (without the CONTENT_QUERY_PREFIX) given the current state from the FilenameCollectionThread's get_current_filenames(). """
+        if current_filenames.current_search_dir is None or current_filenames.candidates is None:
+            return
+
+        if (query_str, current_filenames.current_search_dir) != self.requested_query:
+            self.requested_query = (query_str, current_filenames.current_search_dir)
+            self.input_queue.put(self.NewQuery(
+                query_str=query_str,
+                current_search_dir=current_filenames.current_search_dir,
+                candidate_fns=current_filenames.candidates
+                ))
+
+        elif self.candidate_fns is not None and len(current_filenames.candidates) != len(self.candidate_fns):
+            # more candidates for the same query: they're checked as we get to them, without starting the query over
+            with self.state_lock:
+                self.latest_candidate_fns = current_filenames.candidates
+
+    def get_matches(self, offset=0, limit=None):
+        """ Retrieve a current snapshot of the window of `limit` content matches (or all of them, if limit is None) starting at rank `offset`. """
+        with self.state_lock:
+            return ContentMatches(
+                    matches=self.matches[offset:offset + limit if limit is not None else None],
+                    num_matches=len(self.matches),
+                    search_complete=self.search_complete,
+                    num_indexed=self.num_indexed,
+                    num_candidates=len(self.candidate_fns) if self.candidate_fns is not None else 0)
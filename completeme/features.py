@@ -0,0 +1,62 @@
+import array
+import heapq
+import itertools
+
+class CandidateFeatures(object):
+    """ Query-independent features for all the candidate filenames under a single search directory.
+
+    Features are computed once, when a candidate is first added, and kept in compact parallel arrays indexed by a
+    candidate's position in the table.  Candidates are never removed, so an index stays valid for the lifetime of
+    the table.
+    """
+
+    def __init__(self, search_dir):
+        super(CandidateFeatures, self).__init__()
+        self.search_dir = search_dir
+
+        self.abs_fns = []                             # absolute filenames
+        self.lowered_fns = []                         # lowered filenames relative to search_dir (matched and ranked against)
+        self.depths = array.array("H")                # number of directories in the relative filename
+        self.basename_offsets = array.array("H")      # position of the basename in the relative filename
+
+        self.indexes = {}                             # abs_fn -> idx
+
+        self.sorted_basenames = []                    # (lowered basename, idx), sorted, for everything before num_sorted_basenames
+        self.num_sorted_basenames = 0
+
+    def __len__(self):
+        return len(self.abs_fns)
+
+    def add(self, abs_fns):
+        """ Adds any new candidates and returns the indexes for all of abs_fns, in order. """
+        self.update(abs_fns)
+        return map(self.indexes.__getitem__, abs_fns)
+
+    def update(self, abs_fns):
+        """ Adds any new candidates.  Checking for the ones we've already got happens at C speed. """
+        for abs_fn in itertools.ifilterfalse(self.indexes.__contains__, abs_fns):
+            self._add_one(abs_fn)
+
+    def _add_one(self, abs_fn):
+        assert abs_fn.startswith(self.search_dir), "expected {} to start with {}!".format(abs_fn, self.search_dir)
+        lowered_fn = abs_fn[len(self.search_dir):].lower()
+
+        idx = len(self.abs_fns)
+        self.abs_fns.append(abs_fn)
+        self.lowered_fns.append(lowered_fn)
+        # a leading separator (from peeling off the search directory) isn't a directory
+        self.depths.append(lowered_fn.count("/", 1))
+        self.basename_offsets.append(lowered_fn.rfind("/") + 1)
+        self.indexes[abs_fn] = idx
+        return idx
+
+    def get_basename(self, idx):
+        return self.lowered_fns[idx][self.basename_offsets[idx]:]
+
+    def get_sorted_basenames(self):
+        """ Returns (lowered basename, idx) for every candidate, sorted.  Candidates added since the last call are sorted and merged in. """
+        if self.num_sorted_basenames < len(self):
+            new_basenames = sorted( (self.get_basename(idx), idx) for idx in xrange(self.num_sorted_basenames, len(self)) )
+            self.sorted_basenames = list(heapq.merge(self.sorted_basenames, new_basenames)) if self.sorted_basenames else new_basenames
+            self.num_sorted_basenames = len(self)
+        return self.sorted_basenames
@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import time
+
+_logger = logging.getLogger(__name__)
+
+class FrecencyStore(object):
+    """ Remembers which files were picked from each search root, so they can be shown (and ranked higher) before we've collected anything.
+
+    On disk, it's a small JSON file: { search_root: { abs_fn: [ num_selections, last_selected ] } }.  Frecency is
+    the number of selections weighted by how recently the file was last selected, and only the max_entries most
+    frecent files are kept for each root.
+    """
+    HOUR = 60 * 60
+    DAY = 24 * HOUR
+    WEEK = 7 * DAY
+
+    def __init__(self, store_fn, max_entries=500):
+        super(FrecencyStore, self).__init__()
+        self.store_fn = store_fn
+        self.max_entries = max_entries
+        self.roots = None               # search_root -> { abs_fn: [ num_selections, last_selected ] }, loaded lazily
+        self.frecencies_cache = {}      # search_root -> { abs_fn: frecency } for files that still exist
+
+    def _load(self):
+        if self.roots is not None:
+            return
+
+        self.roots = {}
+        try:
+            with open(self.store_fn, "r") as f:
+                stored = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            _logger.debug("Couldn't load frecency store {}: {}".format(self.store_fn, e))
+            return
+
+        # json gives us unicode, but we deal in (utf-8) byte strings everywhere else
+        for search_root, entries in stored.iteritems():
+            self.roots[search_root.encode("utf-8")] = dict( (abs_fn.encode("utf-8"), entry) for abs_fn, entry in entries.iteritems() )
+        _logger.debug("Loaded {:d} frecency entries from {}".format(sum( map(len, self.roots.values()) ), self.store_fn))
+
+    @classmethod
+    def _get_frecency(cls, num_selections, last_selected, now):
+        age = now - last_selected
+        if age < cls.HOUR:
+            weight = 4.0
+        elif age < cls.DAY:
+            weight = 2.0
+        elif age < cls.WEEK:
+            weight = 1.0
+        else:
+            weight = 0.25
+        return num_selections * weight
+
+    def get_frecencies(self, search_root):
+        """ Returns { abs_fn: frecency } for the files picked from search_root that still exist.  Only looks at the disk the first time. """
+        if search_root not in self.frecencies_cache:
+            self._load()
+            now = time.time()
+            self.frecencies_cache[search_root] = dict(
+                    (abs_fn, self._get_frecency(num_selections, last_selected, now))
+                    for abs_fn, (num_selections, last_selected) in self.roots.get(search_root, {}).iteritems()
+                    if os.path.lexists(abs_fn) )
+        return self.frecencies_cache[search_root]
+
+    def record(self, search_root, abs_fn):
+        """ Counts a selection of abs_fn from search_root and saves the store. """
+        try:
+            search_root.decode("utf-8"), abs_fn.decode("utf-8")
+        except UnicodeDecodeError:
+            _logger.debug("Not remembering non-utf-8 filename {}".format(abs_fn))
+            return
+
+        self._load()
+        now = time.time()
+        entries = self.roots.setdefault(search_root, {})
+        num_selections, _ = entries.get(abs_fn, (0, now))
+        entries[abs_fn] = [ num_selections + 1, now ]
+
+        if len(entries) > self.max_entries:
+            most_frecent = sorted(entries.iteritems(), key=lambda (_, entry): self._get_frecency(entry[0], entry[1], now), reverse=True)
+            self.roots[search_root] = dict(most_frecent[:self.max_entries])
+
+        self.frecencies_cache.pop(search_root, None)
+        self.save()
+
+    def save(self):
+        store_dir = os.path.dirname(self.store_fn)
+        if store_dir and not os.path.isdir(store_dir):
+            os.makedirs(store_dir)
+        tmp_fn = "{}.{:d}.tmp".format(self.store_fn, os.getpid())
+        with open(tmp_fn, "w") as f:
+            json.dump(self.roots, f, separators=(",", ":"))
+        os.rename(tmp_fn, self.store_fn)
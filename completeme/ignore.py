@@ -0,0 +1,126 @@
+import logging
+import os
+import re
+
+_logger = logging.getLogger(__name__)
+
+IGNORE_FNS = (".gitignore", ".ignore")   # ignore files we read in each directory we walk (later files win)
+
+def translate_glob(pattern):
+    """ Translates a gitignore-style glob (without any leading !, or leading or trailing /) into a regex. """
+    regex = ""
+    idx = 0
+    while idx < len(pattern):
+        if pattern.startswith("**/", idx):
+            regex += "(?:.*/)?"
+            idx += 3
+        elif pattern.startswith("/**", idx) and idx + 3 == len(pattern):
+            regex += "/.*"
+            idx += 3
+        elif pattern[idx] == "*":
+            regex += "[^/]*"
+            idx += 1
+        elif pattern[idx] == "?":
+            regex += "[^/]"
+            idx += 1
+        elif pattern[idx] == "[" and pattern.find("]", idx + 2) != -1:
+            end = pattern.find("]", idx + 2)
+            char_class = pattern[idx + 1:end].replace("\\", "\\\\")
+            if char_class.startswith("!"):
+                char_class = "^" + char_class[1:]
+            regex += "[{}]".format(char_class)
+            idx = end + 1
+        else:
+            regex += re.escape(pattern[idx])
+            idx += 1
+    return regex
+
+class IgnoreRules(object):
+    """ Compiled gitignore-style rules from a single source (an ignore file or our config), relative to base_dir.
+
+    Patterns without a slash match the basename of anything under base_dir; patterns with a slash are anchored to
+    base_dir.  Patterns ending in a slash only match directories, and patterns starting with ! re-include what an
+    earlier pattern excluded.
+
+    If there are no negated patterns (the common case), all the patterns are folded into a handful of combined regexes.
+    """
+
+    def __init__(self, base_dir, patterns):
+        super(IgnoreRules, self).__init__()
+        self.base_dir = base_dir
+
+        self.rules = []     # (regex, negated, dir_only, anchored), in order
+        for pattern in patterns:
+            pattern = pattern.rstrip("\n").rstrip()
+            if not pattern or pattern.startswith("#"):
+                continue
+
+            negated = pattern.startswith("!")
+            if negated:
+                pattern = pattern[1:]
+            elif pattern.startswith("\\"):
+                pattern = pattern[1:] # escaped leading ! or #
+
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            anchored = "/" in pattern
+            pattern = pattern.lstrip("/")
+            if not pattern:
+                continue
+
+            self.rules.append((re.compile(translate_glob(pattern) + r"\Z", re.DOTALL), negated, dir_only, anchored))
+
+        self.combined = None
+        if not any( negated for _, negated, _, _ in self.rules ):
+            def combine(anchored, is_dir):
+                regexes = [ regex.pattern for regex, _, dir_only, rule_anchored in self.rules if rule_anchored == anchored and (is_dir or not dir_only) ]
+                return re.compile("|".join( "(?:{})".format(regex) for regex in regexes ), re.DOTALL) if regexes else None
+
+            # (anchored, is_dir) -> regex
+            self.combined = dict( ((anchored, is_dir), combine(anchored, is_dir)) for anchored in (False, True) for is_dir in (False, True) )
+
+    def __nonzero__(self):
+        return bool(self.rules)
+
+    @classmethod
+    def from_file(cls, base_dir, fn):
+        try:
+            with open(fn, "r") as f:
+                return cls(base_dir, f.readlines())
+        except (IOError, OSError):
+            _logger.debug("Couldn't read ignore file {}".format(fn))
+            return cls(base_dir, [])
+
+    def match(self, abs_fn, is_dir):
+        """ Returns True if abs_fn is ignored, False if it's explicitly re-included, or None if no pattern matches it. """
+        rel_fn = abs_fn[len(self.base_dir):].lstrip("/")
+        basename = rel_fn[rel_fn.rfind("/") + 1:]
+
+        if self.combined is not None:
+            basename_regex, rel_regex = self.combined[(False, is_dir)], self.combined[(True, is_dir)]
+            if ((basename_regex is not None and basename_regex.match(basename))
+                    or (rel_regex is not None and rel_regex.match(rel_fn))):
+                return True
+            return None
+
+        # the last matching pattern wins
+        for regex, negated, dir_only, anchored in reversed(self.rules):
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_fn if anchored else basename):
+                return not negated
+        return None
+
+def is_ignored(rules_chain, abs_fn, is_dir):
+    """ Returns whether abs_fn is ignored by rules_chain, a sequence of IgnoreRules from the shallowest to the deepest directory (deeper rules win). """
+    for rules in reversed(rules_chain):
+        matched = rules.match(abs_fn, is_dir)
+        if matched is not None:
+            return matched
+    return False
+
+def extend_rules_chain(rules_chain, dirname, names):
+    """ Returns rules_chain plus the rules from any ignore files in dirname (whose directory listing is names). """
+    new_rules = [ IgnoreRules.from_file(dirname, os.path.join(dirname, fn)) for fn in IGNORE_FNS if fn in names ]
+    new_rules = [ rules for rules in new_rules if rules ]
+    return rules_chain + tuple(new_rules) if new_rules else rules_chain
@@ -0,0 +1,334 @@
+import collections
+import heapq
+import itertools
+import logging
+import time
+
+from .features import CandidateFeatures
+from .matching import MATCH_FUZZY
+from .matching import MATCH_PREFIX
+from .matching import NARROWING_MATCH_MODES
+from .matching import get_prefix_matches
+from .matching import make_matcher
+from .matching import normalize_query
+from .matching import parse_match_mode
+from .utils import ComputationInterruptedException
+
+_logger = logging.getLogger(__name__)
+
+EligibleFile = collections.namedtuple("EligibleFile", [ "abs_fn", "abs_match_positions" ])
+EligibleFilenames = collections.namedtuple("EligibleFilenames", [ "eligible", "num_eligible", "search_complete" ])
+
+MatchTuple = collections.namedtuple("MatchTuple", [ "rank_key", "search_dir", "candidate_idx" ])
+Ranking = collections.namedtuple("Ranking", [ "matchtuples", "matcher" ])
+
+class _IndexRoot(object):
+    """ Everything the Index knows about a single search directory. """
+
+    MAX_CACHED_RANKINGS = 8
+
+    def __init__(self, search_dir):
+        super(_IndexRoot, self).__init__()
+        self.features = CandidateFeatures(search_dir)
+        self.active = bytearray()                   # 1 if candidate idx is currently in the index
+        self.members = set()                        # abs_fns currently in the index
+        self.cache = collections.OrderedDict()      # (match_mode, query) -> _CachedRanking, least recently used first
+        self.removal_generation = 0                 # bumped whenever candidates are removed
+
+    def get_cached(self, cache_key):
+        """ Returns the cached ranking for cache_key (or None), which now counts as the most recently used. """
+        cached = self.cache.pop(cache_key, None)
+        if cached is not None:
+            self.cache[cache_key] = cached
+        return cached
+
+    def set_cached(self, cache_key, cached):
+        """ Caches a ranking, forgetting the least recently used ones if we've got too many. """
+        self.cache.pop(cache_key, None)
+        self.cache[cache_key] = cached
+        while len(self.cache) > self.MAX_CACHED_RANKINGS:
+            self.cache.popitem(last=False)
+
+class Index(object):
+    """ Ranks the candidate filenames under one or more search directories against queries, synchronously and in-process.
+
+    Candidates can be added and removed at any time.  The most recently used few rankings are cached per search
+    directory, match mode and query, and a cached ranking is brought up to date (rather than recomputed) after
+    candidates are added or removed: the CandidateFeatures table only ever grows, so anything added since is just
+    what's past the end of the table.
+
+    All the search directories' rankings are merged for a query.  If a frecency_store is given, files picked before are
+    ranked above equally good matches.
+
+    Matches are sorted in runs of SORT_CHUNK_SIZE and then merged a slice at a time, so that nothing (not even
+    sorting a huge ranking) keeps us from noticing we've been interrupted for long.
+    """
+    INTERRUPT_CHECK_SIZE = 100
+    SORT_CHUNK_SIZE = 5000
+    PARTIAL_RANKING_SIZE = 1000
+
+    _CachedRanking = collections.namedtuple("_CachedRanking", [ "matchtuples", "num_seen", "removal_generation" ])
+
+    def __init__(self, frecency_store=None):
+        super(Index, self).__init__()
+        self.roots = collections.OrderedDict()      # search_dir -> _IndexRoot
+        self.frecency_store = frecency_store        # FrecencyStore of previously selected files (or anything else with get_frecencies(search_dir)), or None
+
+    def _get_root(self, search_dir):
+        if search_dir not in self.roots:
+            self.roots[search_dir] = _IndexRoot(search_dir)
+        return self.roots[search_dir]
+
+    def __len__(self):
+        return sum( len(root.members) for root in self.roots.itervalues() )
+
+    def get_search_dirs(self):
+        return self.roots.keys()
+
+    def add(self, search_dir, abs_fns):
+        """ Adds candidates (absolute filenames under search_dir) to the index.  Anything already there is ignored. """
+        root = self._get_root(search_dir)
+        new_fns = [ abs_fn for abs_fn in abs_fns if abs_fn not in root.members ]
+        if not new_fns:
+            return
+
+        features, active = root.features, root.active
+        num_seen = len(features)
+        readded = False
+        for idx in features.add(new_fns):
+            if idx < num_seen:
+                readded = True
+            else:
+                active.extend("\0" * (idx + 1 - len(active)))
+            active[idx] = 1
+        root.members.update(new_fns)
+
+        if readded:
+            # candidates we'd removed are back, but cached rankings only look past the end of the table for new ones
+            root.cache.clear()
+
+    def remove(self, search_dir, abs_fns):
+        """ Removes candidates from the index.  Anything that isn't there is ignored. """
+        root = self._get_root(search_dir)
+        removed_fns = [ abs_fn for abs_fn in abs_fns if abs_fn in root.members ]
+        if not removed_fns:
+            return
+
+        for abs_fn in removed_fns:
+            root.active[root.features.indexes[abs_fn]] = 0
+        root.members.difference_update(removed_fns)
+        root.removal_generation += 1
+
+    def set_candidates(self, search_dir, abs_fns):
+        """ Makes the candidates for search_dir exactly abs_fns, adding and removing as few as possible. """
+        root = self._get_root(search_dir)
+        if not isinstance(abs_fns, (set, frozenset)):
+            abs_fns = set(abs_fns)
+        self.remove(search_dir, root.members.difference(abs_fns))
+        self.add(search_dir, abs_fns.difference(root.members))
+
+    def query(self, query_str, limit=None, search_dirs=None, default_match_mode=MATCH_FUZZY):
+        """ Returns the (up to limit) best-ranked EligibleFilenames for query_str, which may start with one of the MATCH_MODE_PREFIXES. """
+        ranking = self.rank(query_str, search_dirs=search_dirs, default_match_mode=default_match_mode)
+        return EligibleFilenames(
+                eligible=self.get_eligible_files(ranking, limit=limit),
+                num_eligible=len(ranking.matchtuples),
+                search_complete=True)
+
+    def get_eligible_files(self, ranking, offset=0, limit=None):
+        """ Returns EligibleFiles (with match positions) for the window of `limit` matchtuples starting at rank `offset` of a Ranking. """
+        eligible_files = []
+        for match in ranking.matchtuples[offset:offset + limit if limit is not None else None]:
+            features = self.roots[match.search_dir].features
+            idx = match.candidate_idx
+            match_positions = [ len(features.search_dir) + pos for pos in ranking.matcher.match_positions(features.lowered_fns[idx], features.basename_offsets[idx]) ]
+            eligible_files.append(EligibleFile(abs_fn=features.abs_fns[idx], abs_match_positions=match_positions))
+        return eligible_files
+
+    @staticmethod
+    def _make_rank_key(match_score, frecency, num_dirs_in_path, lowered_fn):
+        """ Returns a key that sorts eligible filenames from best match to worst.
+
+        first, obviously, best match (the matcher's score: (num_nonempty_groups, total_group_length) for fuzzy matching)
+
+        then files we've picked before (most frecent first), so that history boosts a file above equally good matches
+        without pinning it above better ones
+
+        then...
+        prefer files in this directory (num_dirs_in_path==0)
+
+        TODO prefer all directories in this directory, followed by their filenames (recursively)
+        e.g.
+            a/
+            a/stuff.txt
+            a/b/
+            a/b/c/
+            a/b/c/things.dat
+            a/b/c/zebras.zoo
+            x/
+            x/stuff.txt
+            x/y/
+            x/y/z/
+            x/y/z/wowza.txt
+
+        finally, compare the LOWERED filenames (README < hithere.txt)
+        """
+
+        # for fuzzy matching, prefer the fewest number of empty groups (fewest gaps in fuzzy matching)
+        # (more nonempty groups -> show up later in the list)
+        # then the shortest total length of all groups (prefer "MyGreatFile.txt" over "My Documents/stuff/File.txt")
+        # then files we keep coming back to
+        # then files in this directory
+        # and finally in lexicographical order
+        return (match_score, -frecency, 0 if num_dirs_in_path == 0 else 1, lowered_fn)
+
+    def rank(self, query_str, search_dirs=None, default_match_mode=MATCH_FUZZY, interrupted=None, on_partial=None, partial_interval=0.05):
+        """ Returns the Ranking of every candidate (in search_dirs, or all of them) that matches query_str, best first.
+
+        Only a rank key is computed per filename; match positions are computed lazily in get_eligible_files() for
+        what's actually needed.  If interrupted is given, it's called every so often and a ComputationInterruptedException
+        is raised if it returns True.  If on_partial is given and ranking takes longer than partial_interval seconds,
+        it's called (every partial_interval seconds) with a Ranking of the best PARTIAL_RANKING_SIZE matches so far.
+        """
+        match_mode, query_str = parse_match_mode(query_str, default_match_mode)
+        query = normalize_query(match_mode, query_str)
+        matcher = make_matcher(match_mode, query)
+        if matcher is None:
+            # e.g. a regex that doesn't compile (yet); nothing can match
+            return Ranking(matchtuples=[], matcher=matcher)
+
+        search_dirs = search_dirs if search_dirs is not None else self.get_search_dirs()
+        root_matchtuples = []
+        publish_partial = self._PartialPublisher(root_matchtuples, matcher, on_partial, partial_interval, self.PARTIAL_RANKING_SIZE) if on_partial is not None else None
+        for search_dir in search_dirs:
+            root_matchtuples.append(self._rank_root(search_dir, match_mode, query, matcher, interrupted, publish_partial))
+        matchtuples = self._merge(root_matchtuples, interrupted)
+        _logger.debug("Found {:d} eligible matchtuples.".format(len(matchtuples)))
+        return Ranking(matchtuples=matchtuples, matcher=matcher)
+
+    class _PartialPublisher(object):
+        """ Called with the sorted runs of matchtuples we've got so far (for the root being ranked), and passes a Ranking of the best of them (and of the roots already ranked) to on_partial whenever it's due. """
+
+        def __init__(self, root_matchtuples, matcher, on_partial, partial_interval, size):
+            super(Index._PartialPublisher, self).__init__()
+            self.root_matchtuples = root_matchtuples
+            self.matcher = matcher
+            self.on_partial = on_partial
+            self.partial_interval = partial_interval
+            self.size = size
+            self.next_publish = time.time() + partial_interval
+
+        def __call__(self, runs, unsorted_run=()):
+            if time.time() < self.next_publish:
+                return
+            runs = self.root_matchtuples + runs + [ heapq.nsmallest(self.size, unsorted_run) ]
+            self.on_partial(Ranking(matchtuples=list(itertools.islice(heapq.merge(*runs), self.size)), matcher=self.matcher))
+            self.next_publish = time.time() + self.partial_interval
+
+    def _rank_root(self, search_dir, match_mode, query, matcher, interrupted, publish_partial):
+        """ Returns the sorted matchtuples for a single search directory, from (or into) its cache. """
+        root = self._get_root(search_dir)
+        features, active = root.features, root.active
+        removal_generation = root.removal_generation
+
+        def bring_up_to_date(cached):
+            """ Returns cached's matchtuples without anything removed since, and the candidates added since that we still need to search. """
+            matchtuples = cached.matchtuples
+            if cached.removal_generation != removal_generation:
+                matchtuples = [ match for match in matchtuples if active[match.candidate_idx] ]
+            return matchtuples, xrange(cached.num_seen, len(features))
+
+        def search(candidate_idxs, runs):
+            return self._search(search_dir, root, candidate_idxs, matcher, interrupted, runs, publish_partial)
+
+        cache_key = (match_mode, query)
+        cached = root.get_cached(cache_key)
+        prev_cached = root.get_cached((match_mode, query[:-1])) if cached is None and len(query) >= 2 and match_mode in NARROWING_MATCH_MODES else None
+        if cached is not None:
+            matchtuples, new_idxs = bring_up_to_date(cached)
+            if not new_idxs and matchtuples is cached.matchtuples:
+                _logger.debug("Found cached eligible_matchtuples key: {}".format((search_dir, ) + cache_key))
+                return matchtuples
+            runs = search(new_idxs, [ matchtuples ])
+        elif prev_cached is not None:
+            # the prefix minus this last letter has already been computed, so start with those eligible filenames
+            # no need to prune down the whole list if we've already limited the search space (only true of some match modes, though)
+            prev_matchtuples, new_idxs = bring_up_to_date(prev_cached)
+            runs = search([ match.candidate_idx for match in prev_matchtuples ], [])
+            runs = search(new_idxs, runs)
+        elif match_mode == MATCH_PREFIX and query:
+            # no need to look at every candidate; bisect the sorted basenames instead
+            runs = search(get_prefix_matches(features.get_sorted_basenames(), query), [])
+        else:
+            runs = search(xrange(len(features)), [])
+
+        matchtuples = self._merge(runs, interrupted, publish_partial)
+        root.set_cached(cache_key, self._CachedRanking(matchtuples=matchtuples, num_seen=len(features), removal_generation=removal_generation))
+        return matchtuples
+
+    def _merge(self, runs, interrupted, publish_partial=None):
+        """ Merges sorted runs of matchtuples a slice (of SORT_CHUNK_SIZE) at a time, checking for interruptions in between. """
+        runs = [ run for run in runs if run ]
+        if len(runs) <= 1:
+            return runs[0] if runs else []
+
+        if sum(map(len, runs)) - max(map(len, runs)) <= self.SORT_CHUNK_SIZE:
+            # just a few to merge into one big run (e.g. a cached ranking), which sort() gallops through much quicker than we could
+            matchtuples = list(itertools.chain(*runs))
+            matchtuples.sort()
+            return matchtuples
+
+        matchtuples = []
+        merging = heapq.merge(*runs)
+        while True:
+            if interrupted is not None and interrupted():
+                raise ComputationInterruptedException("Merging interrupted!")
+            num_merged = len(matchtuples)
+            matchtuples.extend(itertools.islice(merging, self.SORT_CHUNK_SIZE))
+            if len(matchtuples) == num_merged:
+                return matchtuples
+            if publish_partial is not None:
+                # everything merged so far is final
+                publish_partial([ matchtuples ])
+
+    def _search(self, search_dir, root, candidate_idxs, matcher, interrupted, runs, publish_partial=None):
+        """ Adds sorted runs of matchtuples for the candidates in candidate_idxs that are in the index and match to runs, and returns runs. """
+        _logger.debug("Searching {:d} files in {}".format(len(candidate_idxs), search_dir))
+
+        # for fuzzy input string abc, find a*b*c substrings (consuming as few characters as possible in between)
+        # regex queries are compiled once by make_matcher(), which also guards against ones that don't compile
+        features, active = root.features, root.active
+        lowered_fns, depths, basename_offsets = features.lowered_fns, features.depths, features.basename_offsets
+        frecencies = self.frecency_store.get_frecencies(search_dir) if self.frecency_store is not None else {}
+        score_fn = matcher.score
+
+        matchtuples = []
+        for idx, candidate_idx in enumerate(candidate_idxs):
+            if idx % self.INTERRUPT_CHECK_SIZE == 0:
+                if interrupted is not None and interrupted():
+                    raise ComputationInterruptedException("Searching interrupted!")
+                if publish_partial is not None:
+                    publish_partial(runs, matchtuples)
+
+            if not active[candidate_idx]:
+                continue
+
+            lowered_fn = lowered_fns[candidate_idx]
+            score = score_fn(lowered_fn, basename_offsets[candidate_idx])
+            if score is None:
+                continue
+
+            matchtuples.append(MatchTuple(
+                    rank_key=self._make_rank_key(score, frecencies.get(features.abs_fns[candidate_idx], 0) if frecencies else 0, depths[candidate_idx], lowered_fn),
+                    search_dir=search_dir,
+                    candidate_idx=candidate_idx
+                    ))
+            if len(matchtuples) >= self.SORT_CHUNK_SIZE:
+                matchtuples.sort()
+                runs.append(matchtuples)
+                matchtuples = []
+
+        if matchtuples:
+            matchtuples.sort()
+            runs.append(matchtuples)
+        return runs
@@ -0,0 +1,144 @@
+import bisect
+import collections
+import logging
+import re
+
+from .ignore import translate_glob
+
+_logger = logging.getLogger(__name__)
+
+MATCH_FUZZY = "fuzzy"           # a(.*?)b(.*?)c anywhere in the path
+MATCH_SUBSTRING = "substring"   # abc anywhere in the path
+MATCH_PREFIX = "prefix"         # basename starts with abc
+MATCH_GLOB = "glob"             # gitignore-style glob against the basename (or the relative path, if there's a slash)
+MATCH_REGEX = "regex"           # regex anywhere in the path
+MATCH_MODES = (MATCH_FUZZY, MATCH_SUBSTRING, MATCH_PREFIX, MATCH_GLOB, MATCH_REGEX)
+
+# start a query with one of these to pick its match mode
+MATCH_MODE_PREFIXES = {
+    "'": MATCH_SUBSTRING,
+    "^": MATCH_PREFIX,
+    "=": MATCH_GLOB,
+    "@": MATCH_REGEX,
+}
+
+# modes where anything matching a query also matches the query minus its last character (so we can narrow down previous results)
+NARROWING_MATCH_MODES = (MATCH_FUZZY, MATCH_SUBSTRING, MATCH_PREFIX)
+
+def parse_match_mode(query_str, default_match_mode=MATCH_FUZZY):
+    """ Splits a query into its match mode (from MATCH_MODE_PREFIXES, or default_match_mode) and what's left to match. """
+    if query_str[:1] in MATCH_MODE_PREFIXES:
+        return MATCH_MODE_PREFIXES[query_str[0]], query_str[1:]
+    return default_match_mode, query_str
+
+def normalize_query(match_mode, query_str):
+    """ Everything matches case-insensitively against lowered filenames, but lowering a regex would change its meaning (\\S vs \\s). """
+    return query_str if match_mode == MATCH_REGEX else query_str.lower()
+
+def _fuzzy_score(lowered_query, lowered_fn):
+    """ Cheaply scores a fuzzy match of lowered_query against lowered_fn without building any match positions.
+
+    Returns (num_nonempty_groups, total_group_length) or None if lowered_fn doesn't match.  The matched characters
+    are pushed as far to the right as possible and then packed together lazily, just like the greedy ranking regex
+    (.*)a(.*?)b(.*?)c would do.
+    """
+    # walk backwards to find the latest position at which the whole query can still start
+    start = len(lowered_fn)
+    for ch in reversed(lowered_query):
+        start = lowered_fn.rfind(ch, 0, start)
+        if start == -1:
+            return None
+
+    # then consume as few characters as possible going forward
+    num_nonempty_groups = 0
+    pos = start
+    for ch in lowered_query[1:]:
+        next_pos = lowered_fn.find(ch, pos + 1)
+        if next_pos > pos + 1:
+            num_nonempty_groups += 1
+        pos = next_pos
+
+    return num_nonempty_groups, pos - start + 1 - len(lowered_query)
+
+def _fuzzy_match_positions(lowered_query, lowered_fn):
+    """ Returns the positions in lowered_fn of each character of lowered_query, as ranked by _fuzzy_score(), or None if there's no match. """
+    start = len(lowered_fn)
+    for ch in reversed(lowered_query):
+        start = lowered_fn.rfind(ch, 0, start)
+        if start == -1:
+            return None
+
+    match_positions = [ start ]
+    for ch in lowered_query[1:]:
+        match_positions.append(lowered_fn.find(ch, match_positions[-1] + 1))
+    return match_positions
+
+Matcher = collections.namedtuple("Matcher", [ "score", "match_positions" ])
+def make_matcher(match_mode, query):
+    """ Returns a Matcher for a (normalized) query in the given mode, or None if the query can't match anything (e.g. a bad regex).
+
+    score(lowered_fn, basename_offset) returns a tuple (lower is better) or None if there's no match, and
+    match_positions(lowered_fn, basename_offset) returns the positions in lowered_fn to highlight.  Both only ever see
+    lowered filenames relative to the search directory.
+    """
+    if not query:
+        return Matcher(score=lambda lowered_fn, basename_offset: (), match_positions=lambda lowered_fn, basename_offset: [])
+
+    if match_mode == MATCH_FUZZY:
+        return Matcher(
+                score=lambda lowered_fn, basename_offset: _fuzzy_score(query, lowered_fn),
+                match_positions=lambda lowered_fn, basename_offset: _fuzzy_match_positions(query, lowered_fn))
+
+    elif match_mode == MATCH_SUBSTRING:
+        def score(lowered_fn, basename_offset):
+            # prefer matches in the basename
+            pos = lowered_fn.rfind(query)
+            return None if pos == -1 else (0 if pos >= basename_offset else 1,)
+        def match_positions(lowered_fn, basename_offset):
+            pos = lowered_fn.rfind(query)
+            return range(pos, pos + len(query))
+        return Matcher(score=score, match_positions=match_positions)
+
+    elif match_mode == MATCH_PREFIX:
+        return Matcher(
+                score=lambda lowered_fn, basename_offset: () if lowered_fn.startswith(query, basename_offset) else None,
+                match_positions=lambda lowered_fn, basename_offset: range(basename_offset, basename_offset + len(query)))
+
+    elif match_mode == MATCH_GLOB:
+        # compiled once per query; without a slash, we match just the basename like .gitignore does
+        glob_regex = re.compile(translate_glob(query.strip("/")) + r"\Z", re.DOTALL)
+        if "/" in query:
+            score = lambda lowered_fn, basename_offset: () if glob_regex.match(lowered_fn.lstrip("/")) else None
+        else:
+            score = lambda lowered_fn, basename_offset: () if glob_regex.match(lowered_fn, basename_offset) else None
+        return Matcher(score=score, match_positions=lambda lowered_fn, basename_offset: [])
+
+    elif match_mode == MATCH_REGEX:
+        try:
+            regex = re.compile(query, re.IGNORECASE | re.DOTALL)
+        except re.error as e:
+            _logger.debug("Bad regex '{}': {}".format(query, e))
+            return None
+        # skip the leading slash (there isn't one when searching from /) so that ^ anchors to the start of the relative path
+        def search(lowered_fn):
+            num_skipped = 1 if lowered_fn.startswith("/") else 0
+            return num_skipped, regex.search(lowered_fn[num_skipped:])
+        def score(lowered_fn, basename_offset):
+            num_skipped, match = search(lowered_fn)
+            return None if match is None else (0 if match.start() + num_skipped >= basename_offset else 1,)
+        def match_positions(lowered_fn, basename_offset):
+            num_skipped, match = search(lowered_fn)
+            return range(match.start() + num_skipped, match.end() + num_skipped)
+        return Matcher(score=score, match_positions=match_positions)
+
+    raise Exception("Unrecognized match mode: {}".format(match_mode))
+
+def get_prefix_matches(sorted_basenames, query):
+    """ Bisects a sorted list of (lowered basename, candidate_idx) for the candidates whose basename starts with (lowered) query. """
+    candidate_idxs = []
+    for idx in xrange(bisect.bisect_left(sorted_basenames, (query,)), len(sorted_basenames)):
+        basename, candidate_idx = sorted_basenames[idx]
+        if not basename.startswith(query):
+            break
+        candidate_idxs.append(candidate_idx)
+    return candidate_idxs
@@ -0,0 +1,122 @@
+import collections
+import logging
+import mmap
+import os
+import Queue
+import stat
+import threading
+import traceback
+
+from .profiler import InstrumentedLock, register_thread
+from .utils import get_config
+
+_logger = logging.getLogger(__name__)
+
+Preview = collections.namedtuple("Preview", [ "abs_fn", "lines" ])
+class PreviewThread(threading.Thread):
+    """ Reads the first few lines of files (or lists directories) in the background and keeps the results in a small LRU cache. """
+
+    MAX_LINES = 200                 # nobody's got a terminal taller than this
+    BINARY_CHECK_SIZE = 1024        # bytes to look at for a NUL before deciding a file is binary
+    TAB_WIDTH = 4
+
+    def __init__(self):
+        super(PreviewThread, self).__init__()
+        self.daemon = True
+        self.ex_traceback = None
+
+        self.request_queue = Queue.Queue()
+        self.state_lock = InstrumentedLock("PreviewThread.state_lock")
+        self.should_stop = False
+
+        self.cache = collections.OrderedDict()      # abs_fn -> Preview, least recently used first
+        self.max_cache_size = get_config("preview_cache_size", 64)
+        self.max_bytes = get_config("preview_max_bytes", 64 * 1024)
+
+    def get_traceback(self):
+        """ Returns the traceback for the exception that killed this thread. """
+        return self.ex_traceback
+
+    def stop(self):
+        self.should_stop = True
+
+    def run(self):
+        try:
+            register_thread()
+            while True:
+                if self.should_stop:
+                    return
+
+                try:
+                    abs_fn = self.request_queue.get(timeout=0.05)
+                except Queue.Empty:
+                    continue
+
+                # only bother with the latest request; everything else has already scrolled by
+                while not self.request_queue.empty():
+                    abs_fn = self.request_queue.get()
+
+                with self.state_lock:
+                    if abs_fn in self.cache:
+                        continue
+
+                preview = Preview(abs_fn=abs_fn, lines=self._read_preview_lines(abs_fn))
+                with self.state_lock:
+                    self.cache[abs_fn] = preview
+                    while len(self.cache) > self.max_cache_size:
+                        self.cache.popitem(last=False)
+        except Exception:
+            self.ex_traceback = traceback.format_exc()
+            raise
+
+    def _read_preview_lines(self, abs_fn):
+        try:
+            st = os.stat(abs_fn)
+            if stat.S_ISDIR(st.st_mode):
+                names = sorted(os.listdir(abs_fn))
+                return [ name + "/" if os.path.isdir(os.path.join(abs_fn, name)) else name for name in names[:self.MAX_LINES] ]
+            elif not stat.S_ISREG(st.st_mode):
+                return [ "(not a regular file)" ]
+            elif st.st_size == 0:
+                return [ "(empty file)" ]
+
+            # only ever map (and look at) the first max_bytes, no matter how big the file is
+            with open(abs_fn, "rb") as f:
+                try:
+                    contents = mmap.mmap(f.fileno(), min(st.st_size, self.max_bytes), access=mmap.ACCESS_READ)
+                except mmap.error:
+                    # some files (e.g. in /sys) can't be mapped, so just read them
+                    contents = f.read(self.max_bytes)
+            try:
+                if contents.find("\0", 0, self.BINARY_CHECK_SIZE) != -1:
+                    return [ "(binary file, {:d} bytes)".format(st.st_size) ]
+                lines = contents[:].split("\n", self.MAX_LINES)[:self.MAX_LINES]
+            finally:
+                if isinstance(contents, mmap.mmap):
+                    contents.close()
+        except (EnvironmentError, ValueError) as e:
+            return [ "(couldn't read {}: {})".format(abs_fn, e) ]
+
+        return [ self._clean_line(line) for line in lines ]
+
+    @classmethod
+    def _clean_line(cls, line):
+        """ Expands tabs and drops any other control characters, which would mess up the screen. """
+        return "".join( ch for ch in line.expandtabs(cls.TAB_WIDTH) if ch >= " " and ch != "\x7f" )
+
+    def request(self, abs_fn):
+        """ Asks for a preview of abs_fn, unless we've already got one. """
+        with self.state_lock:
+            if abs_fn in self.cache:
+                return
+        self.request_queue.put(abs_fn)
+
+    def get_preview(self, abs_fn):
+        """ Returns the Preview for abs_fn if we've got one, or None if it hasn't been read yet.  Never blocks on I/O. """
+        with self.state_lock:
+            preview = self.cache.get(abs_fn)
+            if preview is not None:
+                # most recently used goes to the back
+                del self.cache[abs_fn]
+                self.cache[abs_fn] = preview
+        return preview
@@ -0,0 +1,202 @@
+import collections
+import ctypes
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+import traceback
+
+_logger = logging.getLogger(__name__)
+
+_profiling = False                                          # only time lock waits while we're profiling
+_lock_waits = collections.defaultdict(lambda: [ 0.0, 0 ])   # (lock name, thread label) -> [ seconds spent waiting, number of acquires ]
+_lock_waits_lock = threading.Lock()
+_native_thread_ids = {}                                     # python thread ident -> linux thread id (for /proc/self/task)
+
+_SYS_GETTID = { "x86_64": 186, "i386": 224, "i686": 224, "aarch64": 178, "armv7l": 224 }
+def _gettid():
+    """ Returns the linux thread id of the calling thread, or None if we can't find it (e.g. not linux). """
+    if not sys.platform.startswith("linux") or platform.machine() not in _SYS_GETTID:
+        return None
+    try:
+        return ctypes.CDLL(None).syscall(_SYS_GETTID[platform.machine()])
+    except (OSError, AttributeError):
+        return None
+
+def register_thread():
+    """ Remembers the calling thread's linux thread id so we can report its CPU time.  Call this first thing in a thread's run(). """
+    _native_thread_ids[threading.current_thread().ident] = _gettid()
+
+def _get_thread_label(th):
+    return th.name if isinstance(th, threading._MainThread) else "{}:{}".format(type(th).__name__, th.name)
+
+def _get_thread_cpu_time(tid):
+    """ Returns the user + system CPU seconds used so far by linux thread tid, or None if we can't read them. """
+    try:
+        with open("/proc/self/task/{:d}/stat".format(tid), "r") as f:
+            stat_fields = f.read().rsplit(")", 1)[1].split()
+    except (IOError, IndexError):
+        return None
+    # utime and stime are the 14th and 15th fields; we've split off the first two (pid and (comm))
+    return (int(stat_fields[11]) + int(stat_fields[12])) / float(os.sysconf("SC_CLK_TCK"))
+
+class InstrumentedLock(object):
+    """ A threading.Lock that keeps track of how long each thread waits to acquire it while the profiler is running. """
+
+    def __init__(self, name):
+        super(InstrumentedLock, self).__init__()
+        self.name = name
+        self.lock = threading.Lock()
+
+    def acquire(self, blocking=True):
+        if not _profiling:
+            return self.lock.acquire(blocking)
+
+        start = time.time()
+        acquired = self.lock.acquire(blocking)
+        waited = time.time() - start
+        with _lock_waits_lock:
+            lock_wait = _lock_waits[(self.name, _get_thread_label(threading.current_thread()))]
+            lock_wait[0] += waited
+            lock_wait[1] += 1
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+class SamplingProfiler(threading.Thread):
+    """ Samples the stacks of every thread every interval seconds until stopped, then writes a report to output_dir.
+
+    The report is two files: collapsed stacks (one "thread;outermost frame;...;innermost frame count" line per
+    distinct stack, ready for flamegraph.pl) and a summary of samples, CPU time and state_lock waits per thread.
+    """
+
+    def __init__(self, output_dir, interval=0.005):
+        super(SamplingProfiler, self).__init__()
+        self.daemon = True
+        self.ex_traceback = None
+
+        self.output_dir = output_dir
+        self.interval = interval
+        self.should_stop = False
+
+        self.stack_counts = collections.Counter()       # collapsed stack -> number of samples
+        self.thread_sample_counts = collections.Counter()
+        self.start_cpu_times = {}                       # thread label -> CPU seconds when we started
+        self.report_fns = None
+
+    def get_traceback(self):
+        """ Returns the traceback for the exception that killed this thread. """
+        return self.ex_traceback
+
+    def stop(self):
+        self.should_stop = True
+
+    @staticmethod
+    def _get_cpu_times():
+        """ Returns thread label -> CPU seconds for all our (registered) threads. """
+        cpu_times = {}
+        for th in threading.enumerate():
+            tid = _native_thread_ids.get(th.ident)
+            cpu_time = _get_thread_cpu_time(tid) if tid is not None else None
+            if cpu_time is not None:
+                cpu_times[_get_thread_label(th)] = cpu_time
+        return cpu_times
+
+    def _sample(self):
+        thread_labels = dict( (th.ident, _get_thread_label(th)) for th in threading.enumerate() )
+        for ident, frame in sys._current_frames().iteritems():
+            if ident == self.ident:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{} ({}:{:d})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+
+            thread_label = thread_labels.get(ident, str(ident))
+            stack.append(thread_label)
+            self.stack_counts[";".join(reversed(stack))] += 1
+            self.thread_sample_counts[thread_label] += 1
+
+    def run(self):
+        global _profiling
+        try:
+            register_thread()
+            with _lock_waits_lock:
+                _lock_waits.clear()
+            _profiling = True
+            self.start_cpu_times = self._get_cpu_times()
+            start = time.time()
+
+            while not self.should_stop:
+                self._sample()
+                time.sleep(self.interval)
+
+            _profiling = False
+            self._write_report(time.time() - start)
+        except Exception:
+            _profiling = False
+            self.ex_traceback = traceback.format_exc()
+            raise
+
+    def _write_report(self, duration):
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        base_fn = os.path.join(self.output_dir, "profile-{:d}-{}".format(os.getpid(), time.strftime("%Y%m%d-%H%M%S")))
+
+        with open(base_fn + ".collapsed", "w") as f:
+            for stack, count in sorted(self.stack_counts.iteritems()):
+                print >> f, "{} {:d}".format(stack, count)
+
+        end_cpu_times = self._get_cpu_times()
+        with _lock_waits_lock:
+            lock_waits = sorted(_lock_waits.iteritems())
+
+        with open(base_fn + ".txt", "w") as f:
+            print >> f, "# {:d} samples per thread over {:.2f}s (every {:.0f}ms)".format(
+                    max(self.thread_sample_counts.values() or [ 0 ]), duration, self.interval * 1000)
+            print >> f, "{:<50} {:>10} {:>10}".format("thread", "samples", "cpu_s")
+            for thread_label in sorted(set(self.thread_sample_counts) | set(end_cpu_times)):
+                cpu_time = end_cpu_times.get(thread_label)
+                print >> f, "{:<50} {:>10d} {:>10}".format(
+                        thread_label,
+                        self.thread_sample_counts[thread_label],
+                        "{:.3f}".format(cpu_time - self.start_cpu_times.get(thread_label, 0.0)) if cpu_time is not None else "-")
+
+            print >> f
+            print >> f, "{:<40} {:<50} {:>10} {:>10}".format("lock", "thread", "acquires", "wait_s")
+            for (lock_name, thread_label), (waited, num_acquires) in lock_waits:
+                print >> f, "{:<40} {:<50} {:>10d} {:>10.3f}".format(lock_name, thread_label, num_acquires, waited)
+
+        self.report_fns = (base_fn + ".collapsed", base_fn + ".txt")
+        _logger.debug("Wrote profile to {}".format(self.report_fns))
+
+_current_profiler = None
+def toggle_profiler(output_dir):
+    """ Starts a SamplingProfiler, or stops the running one (which then writes its report). """
+    global _current_profiler
+    if _current_profiler is not None and _current_profiler.is_alive():
+        _current_profiler.stop()
+        _current_profiler = None
+    else:
+        _current_profiler = SamplingProfiler(output_dir)
+        _current_profiler.start()
+
+def stop_profiler():
+    """ Stops the running SamplingProfiler (if any) and waits for its report. """
+    global _current_profiler
+    if _current_profiler is not None:
+        _current_profiler.stop()
+        _current_profiler.join()
+        _current_profiler = None
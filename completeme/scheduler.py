@@ -0,0 +1,48 @@
+import threading
+import time
+
+class Scheduler(object):
+    """ Cooperative scheduling between searching and collecting candidates: the search for the latest keystroke goes first.
+
+    The UI calls search_requested() when it queues up a search for new input, and the SearchThread calls
+    search_finished() when it's got nothing left to do.  In between, background ingestion calls yield_to_search()
+    before publishing each batch of candidates, which backs off (for up to max_backoff seconds at a time, so
+    collection never stalls completely) until the search is done.  Long-running searches call end_time_slice()
+    every so often so that the UI thread gets the GIL at least once every time_slice seconds.
+    """
+
+    def __init__(self, max_backoff=0.05, time_slice=0.005):
+        super(Scheduler, self).__init__()
+        self.max_backoff = max_backoff
+        self.time_slice = time_slice
+        self.search_pending = threading.Event()
+        self.slice_start = time.time()
+
+    def search_requested(self):
+        self.search_pending.set()
+
+    def search_finished(self):
+        self.search_pending.clear()
+
+    def is_search_pending(self):
+        return self.search_pending.is_set()
+
+    def yield_to_search(self):
+        """ Waits (for no more than max_backoff seconds) while a search is pending.  Returns how long we waited. """
+        if not self.search_pending.is_set():
+            return 0.0
+
+        start = time.time()
+        while self.search_pending.is_set() and time.time() - start < self.max_backoff:
+            time.sleep(0.002)
+        return time.time() - start
+
+    def end_time_slice(self):
+        """ Gives up the GIL if the calling thread has had it for a whole time slice (or so). """
+        now = time.time()
+        if now - self.slice_start >= self.time_slice:
+            time.sleep(0)
+            self.slice_start = time.time()
+
+# shared by every thread
+scheduler = Scheduler()
@@ -1,6 +1,9 @@
+import collections
 import json
 import logging
 import os
+import threading
+import time
 
 import pkg_resources
 
@@ -41,17 +44,88 @@ def get_config(key, default="NO_DEFAULT"):
 
     return load_config()[key] if default == "NO_DEFAULT" else load_config().get(key, default)
 
+class PathCache(object):
+    """ Caches path resolution and stat results, which we'd otherwise redo several times per frame.
+
+    Entries expire after ttl seconds or when invalidate() bumps the generation, whichever comes first, and only the
+    max_entries most recently computed are kept.  It's shared between threads, so a value computed while
+    invalidate() was called isn't stored.  Hit and miss counts are approximate (no locking) and only reported
+    through the debug log.
+    """
+    REPORT_EVERY = 10000
+
+    def __init__(self, ttl, max_entries=10000):
+        super(PathCache, self).__init__()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.entries = collections.OrderedDict()  # (kind, key) -> (generation, timestamp, value), least recently computed first
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def get(self, kind, key, compute_fn):
+        """ Returns the cached value for (kind, key), calling compute_fn(key) if it's missing or stale. """
+        now = time.time()
+        with self.lock:
+            generation = self.generation
+            entry = self.entries.get((kind, key))
+
+        if entry is not None and entry[0] == generation and now - entry[1] < self.ttl:
+            self.num_hits += 1
+            value = entry[2]
+        else:
+            self.num_misses += 1
+            # (computed without holding the lock, since it might hit the filesystem)
+            value = compute_fn(key)
+            with self.lock:
+                if self.generation == generation:
+                    self.entries.pop((kind, key), None)
+                    self.entries[(kind, key)] = (generation, now, value)
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+
+        if (self.num_hits + self.num_misses) % self.REPORT_EVERY == 0:
+            self.log_stats()
+        return value
+
+    def invalidate(self):
+        """ Forget everything, e.g. because we're about to look at the filesystem again anyway. """
+        with self.lock:
+            self.generation += 1
+            self.entries = collections.OrderedDict()
+
+    def log_stats(self):
+        total = self.num_hits + self.num_misses
+        _logger.debug("Path cache: {:d} hits, {:d} misses ({:.1f}% hit rate), {:d} entries.".format(
+            self.num_hits, self.num_misses, 100.0 * self.num_hits / total if total else 0.0, len(self.entries)))
+
+PATH_CACHE_TTL = 2.0 # seconds
+path_cache = PathCache(PATH_CACHE_TTL)
+
+def cached_isdir(path):
+    return path_cache.get("isdir", path, os.path.isdir)
+
+def cached_expanduser(path):
+    return path_cache.get("expanduser", path, os.path.expanduser)
+
+def cached_relpath(path):
+    """ os.path.relpath() relative to the current directory (which calls getcwd() every time). """
+    return path_cache.get("relpath", path, os.path.relpath)
+
 def split_search_dir_and_query(input_str):
     """ Given an input_str, deduce what directory we should search, either by relative path (../../whatever) or by absolute path (/). """
+    return path_cache.get("split_search_dir_and_query", input_str, _split_search_dir_and_query)
 
+def _split_search_dir_and_query(input_str):
     # first, expand any user tildes or whatever (~/whatever, ~user/whatever)
-    dirname = os.path.expanduser(input_str)
+    dirname = cached_expanduser(input_str)
     query = ""
     is_first = True # the whole input string must end in a slash to be checked for a directory
 
     # now, peel off directories until we find one that matches
     while dirname:
-        if (os.path.isdir(dirname) and (not is_first or dirname.endswith("/"))):
+        if ((not is_first or dirname.endswith("/")) and cached_isdir(dirname)):
             # we've found a directory that exists!  search here
             return os.path.abspath(dirname), query
 
@@ -0,0 +1,25 @@
+import unittest
+
+from completeme.features import CandidateFeatures
+
+class CandidateFeaturesTest(unittest.TestCase):
+
+    def test_features(self):
+        """ Ensures that we compute the relative path, depth and basename offset once per candidate. """
+        features = CandidateFeatures("/home/me")
+        idxs = features.add(["/home/me/README", "/home/me/src/Main/App.java", "/home/me/README"])
+
+        self.assertEqual(idxs, [0, 1, 0])
+        self.assertEqual(len(features), 2)
+
+        self.assertEqual(features.lowered_fns[1], "/src/main/app.java")
+        self.assertEqual(features.depths[0], 0)
+        self.assertEqual(features.depths[1], 2)
+        self.assertEqual(features.lowered_fns[1][features.basename_offsets[1]:], "app.java")
+
+    def test_root_search_dir(self):
+        """ Ensures that the first directory counts when searching from / (there's no leading separator to peel off). """
+        features = CandidateFeatures("/")
+        features.add(["/etc/hosts"])
+        self.assertEqual(features.lowered_fns[0], "etc/hosts")
+        self.assertEqual(features.depths[0], 1)
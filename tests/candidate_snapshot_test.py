@@ -0,0 +1,20 @@
+import unittest
+
+from completeme.collection import CandidateSnapshot
+
+class CandidateSnapshotTest(unittest.TestCase):
+
+    def test_snapshot(self):
+        """ Ensures that snapshots only see what was there when they were taken, and know what's been added since. """
+        fns, fn_set = [ "/a", "/b" ], set([ "/a", "/b" ])
+        snapshot = CandidateSnapshot(fns, len(fns), fn_set)
+        fns.append("/c")
+        fn_set.add("/c")
+        later_snapshot = CandidateSnapshot(fns, len(fns), fn_set)
+
+        self.assertEqual(list(snapshot), [ "/a", "/b" ])
+        self.assertEqual(len(snapshot), 2)
+        self.assertEqual(snapshot.difference([ "/a" ]), set([ "/b" ]))
+        self.assertEqual(later_snapshot.get_added_since(snapshot), [ "/c" ])
+        self.assertEqual(later_snapshot.get_added_since(None), None)
+        self.assertEqual(later_snapshot.get_added_since(CandidateSnapshot([ "/a" ], 1, set([ "/a" ]))), None)
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from completeme.collection import CommandSource, FileListSource, FilenameCollectionThread, StdinSource
+
+class CandidateSourceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = os.path.realpath(tempfile.mkdtemp())
+        os.mkdir(os.path.join(self.tmp_dir, "src"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def collect(self, input_str, candidate_source):
+        """ Helper for spinning up a collection thread and waiting for it to finish. """
+        bg_thread = FilenameCollectionThread(input_str, candidate_source)
+        bg_thread.start()
+
+        start = time.time()
+        while True:
+            current_filenames = bg_thread.get_current_filenames()
+            if not current_filenames.candidate_computation_complete:
+                if time.time() - start > 2:
+                    raise Exception("This should have taken way less than two seconds...")
+                time.sleep(0.01)
+                continue
+
+            bg_thread.stop()
+            return sorted( os.path.relpath(fn, self.tmp_dir) for fn in current_filenames.candidates )
+
+    def test_command_source(self):
+        """ Ensures that a command's output is used as filenames relative to the search directory. """
+        self.assertEqual(
+                self.collect(os.path.join(self.tmp_dir, ""), CommandSource("printf 'a.txt\\nsrc/b.txt\\n'")),
+                [ "a.txt", "src", "src/b.txt" ])
+
+    def test_file_list_source(self):
+        """ Ensures that only filenames under the search directory are collected from a file list. """
+        list_fn = os.path.join(self.tmp_dir, "manifest.txt")
+        with open(list_fn, "w") as f:
+            f.write("a.txt\nsrc/b.txt\n../elsewhere.txt\n")
+
+        self.assertEqual(self.collect(os.path.join(self.tmp_dir, "src/"), FileListSource(list_fn, self.tmp_dir)), [ "src/b.txt" ])
+
+    def test_stdin_source(self):
+        """ Ensures that a stream is only read once, but its filenames are still there when we switch search directories. """
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, "a.txt\nsrc/b.txt")
+        os.close(write_fd)
+
+        source = StdinSource(os.fdopen(read_fd, "rb"), self.tmp_dir)
+        self.assertEqual(self.collect(os.path.join(self.tmp_dir, ""), source), [ "a.txt", "src", "src/b.txt" ])
+        self.assertEqual(self.collect(os.path.join(self.tmp_dir, "src/"), source), [ "src/b.txt" ])
+
+    def test_command_source_stderr(self):
+        """ Ensures that a command that writes lots to stderr doesn't block. """
+        self.assertEqual(
+                self.collect(os.path.join(self.tmp_dir, ""), CommandSource("head -c 200000 /dev/zero >&2; echo a.txt")),
+                [ "a.txt" ])
+
+    def test_command_source_killed(self):
+        """ Ensures that stopping early kills everything a shell command started. """
+        pid_fn = os.path.join(self.tmp_dir, "pid")
+        batches = CommandSource("sleep 30 & echo $! > {}; echo a.txt; wait".format(pid_fn)).get_batches(self.tmp_dir)
+        while not any(next(batches)):
+            pass
+        batches.close()
+
+        with open(pid_fn) as f:
+            pid = int(f.read())
+        start = time.time()
+        while self.is_running(pid):
+            if time.time() - start > 2:
+                raise Exception("The command's children should have been killed.")
+            time.sleep(0.01)
+
+    @staticmethod
+    def is_running(pid):
+        try:
+            with open("/proc/{:d}/status".format(pid)) as f:
+                return "zombie" not in f.read()
+        except IOError:
+            return False
@@ -0,0 +1,22 @@
+import unittest
+
+from completeme.completeme import _get_display_line
+
+class DisplayLineTest(unittest.TestCase):
+
+    def test_control_characters(self):
+        """ Ensures that tabs are expanded and other control characters dropped, and that the match positions follow along. """
+        line, positions = _get_display_line("\tfoo\r", [ 1, 2, 3 ], 80)
+        self.assertEqual(line, "    foo")
+        self.assertEqual([ line[pos] for pos in positions ], list("foo"))
+
+    def test_clipped_around_match(self):
+        """ Ensures that a long line is clipped so that the match (and some context before it) shows up. """
+        raw_line = "x" * 1000 + "needle" + "y" * 1000
+        line, positions = _get_display_line(raw_line, range(1000, 1006), 40)
+        self.assertEqual(len(line), 40)
+        self.assertEqual("".join( line[pos] for pos in positions ), "needle")
+        self.assertTrue(positions[0] >= 5)
+
+        line, positions = _get_display_line("needle" + "y" * 1000, range(0, 6), 40)
+        self.assertEqual(positions, range(0, 6))
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from completeme.history import FrecencyStore
+from completeme.index import Index
+
+from user_input_regex_test import make_filenames, run_search
+
+class FrecencyStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store_fn = os.path.join(self.tmp_dir, "history", "history.json")
+        for fn in ("often.txt", "once.txt", "never.txt"):
+            open(os.path.join(self.tmp_dir, fn), "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_record_and_load(self):
+        """ Ensures that selections are saved per search root, counted, and forgotten once the file is gone. """
+        often, once = os.path.join(self.tmp_dir, "often.txt"), os.path.join(self.tmp_dir, "once.txt")
+
+        store = FrecencyStore(self.store_fn)
+        store.record(self.tmp_dir, often)
+        store.record(self.tmp_dir, often)
+        store.record(self.tmp_dir, once)
+        store.record(self.tmp_dir, os.path.join(self.tmp_dir, "deleted.txt"))
+
+        frecencies = FrecencyStore(self.store_fn).get_frecencies(self.tmp_dir)
+        self.assertEqual(sorted(frecencies), [ often, once ])
+        self.assertTrue(frecencies[often] > frecencies[once])
+        self.assertEqual(FrecencyStore(self.store_fn).get_frecencies("/some/other/root"), {})
+
+    def test_max_entries(self):
+        """ Ensures that only the most frecent files are kept. """
+        often, once = os.path.join(self.tmp_dir, "often.txt"), os.path.join(self.tmp_dir, "once.txt")
+
+        store = FrecencyStore(self.store_fn, max_entries=1)
+        store.record(self.tmp_dir, often)
+        store.record(self.tmp_dir, often)
+        store.record(self.tmp_dir, once)
+        self.assertEqual(FrecencyStore(self.store_fn).get_frecencies(self.tmp_dir).keys(), [ often ])
+
+    def test_search_before_collection(self):
+        """ Ensures that previously selected files are found (and ranked above equally good matches) even before they've been collected. """
+        often, never = os.path.join(self.tmp_dir, "often.txt"), os.path.join(self.tmp_dir, "never.txt")
+        store = FrecencyStore(self.store_fn)
+        store.record(self.tmp_dir, often)
+
+        eligible_fns = run_search(os.path.join(self.tmp_dir, "txt"), make_filenames(self.tmp_dir, [ "never.txt" ], complete=False), frecency_store=FrecencyStore(self.store_fn))
+        self.assertEqual([ eligible_fn.abs_fn for eligible_fn in eligible_fns.eligible ], [ often, never ])
+
+    def test_boost_not_pin(self):
+        """ Ensures that a previously selected file doesn't outrank a better match. """
+        os.mkdir(os.path.join(self.tmp_dir, "a"))
+        exact, spread = os.path.join(self.tmp_dir, "abc.txt"), os.path.join(self.tmp_dir, "a", "xbxcx.txt")
+        for fn in (exact, spread):
+            open(fn, "w").close()
+        store = FrecencyStore(self.store_fn)
+        store.record(self.tmp_dir, spread)
+
+        index = Index(store)
+        index.add(self.tmp_dir, [ exact, spread ])
+        self.assertEqual([ eligible_fn.abs_fn for eligible_fn in index.query("abc").eligible ], [ exact, spread ])
+        self.assertEqual([ eligible_fn.abs_fn for eligible_fn in index.query("").eligible ], [ spread, exact ])
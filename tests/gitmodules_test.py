@@ -0,0 +1,37 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from completeme.collection import parse_gitmodules
+
+class GitmodulesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.gitmodules_fn = os.path.join(self.tmp_dir, ".gitmodules")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parse_gitmodules(self):
+        """ Ensures that we find every submodule path, including ones with spaces, quotes and comments. """
+        with open(self.gitmodules_fn, "w") as f:
+            f.write("\n".join([
+                '[submodule "vendor/lib"]',
+                '\tpath = vendor/lib',
+                '\turl = https://example.com/lib.git',
+                '[submodule "docs theme"]',
+                '\tpath = "third party/docs theme" ; where it lives',
+                '\tURL = ../theme.git',
+                '[core]',
+                '\tpath = not/a/submodule',
+                '[submodule "escaped"]',
+                '\tPath=has \\"quotes\\" # comment',
+                ]))
+
+        self.assertEqual(parse_gitmodules(self.gitmodules_fn), [ "vendor/lib", "third party/docs theme", 'has "quotes"' ])
+
+    def test_missing_gitmodules(self):
+        """ Ensures that a repository without submodules is fine. """
+        self.assertEqual(parse_gitmodules(self.gitmodules_fn), [])
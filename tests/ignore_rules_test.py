@@ -0,0 +1,29 @@
+import unittest
+
+from completeme.ignore import IgnoreRules, is_ignored
+
+class IgnoreRulesTest(unittest.TestCase):
+
+    def test_patterns(self):
+        """ Ensures that we handle basename, anchored, directory-only and ** patterns like git does. """
+        rules = IgnoreRules("/repo", [ "# a comment", "", "*.pyc", "/build", "node_modules/", "docs/**/*.html" ])
+
+        self.assertTrue(rules.match("/repo/a/b/thing.pyc", False))
+        self.assertTrue(rules.match("/repo/build", True))
+        self.assertIsNone(rules.match("/repo/src/build", True))
+        self.assertTrue(rules.match("/repo/web/node_modules", True))
+        self.assertIsNone(rules.match("/repo/web/node_modules", False))
+        self.assertTrue(rules.match("/repo/docs/index.html", False))
+        self.assertTrue(rules.match("/repo/docs/a/b/index.html", False))
+        self.assertIsNone(rules.match("/repo/src/index.html", False))
+        self.assertIsNone(rules.match("/repo/thing.py", False))
+
+    def test_negation(self):
+        """ Ensures that the last matching pattern wins and that deeper ignore files override shallower ones. """
+        rules = IgnoreRules("/repo", [ "*.log", "!keep.log" ])
+        self.assertTrue(rules.match("/repo/debug.log", False))
+        self.assertFalse(rules.match("/repo/keep.log", False))
+
+        deeper_rules = IgnoreRules("/repo/logs", [ "!*.log" ])
+        self.assertTrue(is_ignored([ rules ], "/repo/logs/debug.log", False))
+        self.assertFalse(is_ignored([ rules, deeper_rules ], "/repo/logs/debug.log", False))
@@ -0,0 +1,112 @@
+import random
+import unittest
+
+from completeme.index import Index
+from completeme.matching import MATCH_FUZZY, MATCH_SUBSTRING
+
+class IndexTest(unittest.TestCase):
+    SEARCH_DIR = "/home/me/project"
+
+    def make_fns(self, *fns):
+        return [ "{}/{}".format(self.SEARCH_DIR, fn) for fn in fns ]
+
+    def query(self, index, query_str, **kwargs):
+        return [ eligible_fn.abs_fn[len(self.SEARCH_DIR) + 1:] for eligible_fn in index.query(query_str, **kwargs).eligible ]
+
+    def test_query(self):
+        """ Ensures that queries are ranked, limited and highlighted without any threads. """
+        index = Index()
+        index.add(self.SEARCH_DIR, self.make_fns("My Documents/Wow/Remember Those Days?.txt", "mydays.txt", "unrelated.txt"))
+
+        self.assertEqual(self.query(index, "mydays"), [ "mydays.txt", "My Documents/Wow/Remember Those Days?.txt" ])
+        self.assertEqual(self.query(index, "mydays", limit=1), [ "mydays.txt" ])
+        self.assertEqual(index.query("mydays", limit=1).num_eligible, 2)
+        self.assertEqual(self.query(index, "'wow/", default_match_mode=MATCH_SUBSTRING), [ "My Documents/Wow/Remember Those Days?.txt" ])
+
+        best = index.query("mydays", limit=1).eligible[0]
+        self.assertEqual("".join( best.abs_fn[pos] for pos in best.abs_match_positions ), "mydays")
+
+    def test_add_and_remove(self):
+        """ Ensures that cached (and narrowed) rankings stay right as candidates come and go. """
+        index = Index()
+        index.add(self.SEARCH_DIR, self.make_fns("abc.txt", "abd.txt"))
+        self.assertEqual(self.query(index, "ab"), [ "abc.txt", "abd.txt" ])
+        self.assertEqual(self.query(index, "abc"), [ "abc.txt" ])
+
+        index.add(self.SEARCH_DIR, self.make_fns("xabc.txt"))
+        self.assertEqual(self.query(index, "abc"), [ "abc.txt", "xabc.txt" ])
+        self.assertEqual(self.query(index, "abc."), [ "abc.txt", "xabc.txt" ])
+
+        index.remove(self.SEARCH_DIR, self.make_fns("abc.txt"))
+        self.assertEqual(self.query(index, "abc"), [ "xabc.txt" ])
+        self.assertEqual(self.query(index, "ab"), [ "abd.txt", "xabc.txt" ])
+
+        index.add(self.SEARCH_DIR, self.make_fns("abc.txt"))
+        self.assertEqual(self.query(index, "abc"), [ "abc.txt", "xabc.txt" ])
+
+        index.set_candidates(self.SEARCH_DIR, self.make_fns("abd.txt"))
+        self.assertEqual(self.query(index, "ab"), [ "abd.txt" ])
+        self.assertEqual(len(index), 1)
+
+    def test_incremental_matches_fresh(self):
+        """ Ensures that an index that's seen lots of changes ranks exactly like one built from scratch. """
+        rand = random.Random(0)
+        all_fns = self.make_fns(*[ "/".join( rand.choice([ "src", "lib", "abc", "main", "x" ]) for _ in xrange(rand.randint(1, 4)) ) + ".py" for _ in xrange(300) ])
+
+        index = Index()
+        for _ in xrange(20):
+            index.add(self.SEARCH_DIR, rand.sample(all_fns, 30))
+            index.remove(self.SEARCH_DIR, rand.sample(all_fns, 10))
+            for query_str in ("m", "ma", "mai", "^ma", "'src", "=*.py"):
+                fresh_index = Index()
+                fresh_index.add(self.SEARCH_DIR, list(index.roots[self.SEARCH_DIR].members))
+                self.assertEqual(self.query(index, query_str), self.query(fresh_index, query_str))
+
+    def test_sorted_in_chunks(self):
+        """ Ensures that rankings sorted and merged in small chunks are exactly the same, and that partial rankings are the best so far. """
+        rand = random.Random(1)
+        fns = self.make_fns(*[ "/".join( rand.choice([ "src", "lib", "abc", "main", "x" ]) for _ in xrange(rand.randint(1, 4)) ) + "{:d}.py".format(idx) for idx in xrange(500) ])
+
+        index = Index()
+        index.add(self.SEARCH_DIR, fns)
+        expected = self.query(index, "ma")
+
+        chunked_index = Index()
+        chunked_index.SORT_CHUNK_SIZE = 7
+        chunked_index.PARTIAL_RANKING_SIZE = 5
+        chunked_index.add(self.SEARCH_DIR, fns)
+        partials = []
+        ranking = chunked_index.rank("ma", on_partial=partials.append, partial_interval=0)
+        self.assertEqual([ eligible_fn.abs_fn[len(self.SEARCH_DIR) + 1:] for eligible_fn in chunked_index.get_eligible_files(ranking) ], expected)
+
+        self.assertTrue(partials)
+        for partial in partials:
+            self.assertTrue(len(partial.matchtuples) <= 5)
+            self.assertEqual(partial.matchtuples, sorted(partial.matchtuples))
+        self.assertEqual(partials[-1].matchtuples, ranking.matchtuples[:len(partials[-1].matchtuples)])
+
+    def test_root_search_dir(self):
+        """ Ensures that regexes anchor to the start of the relative path when searching from / (which has no leading separator to skip). """
+        index = Index()
+        index.add("/", [ "/etc/hosts", "/usr/etc/motd" ])
+
+        self.assertEqual([ eligible_fn.abs_fn for eligible_fn in index.query("@^etc").eligible ], [ "/etc/hosts" ])
+        self.assertEqual(index.query("@^tc").num_eligible, 0)
+
+        best = index.query("@^etc/h").eligible[0]
+        self.assertEqual("".join( best.abs_fn[pos] for pos in best.abs_match_positions ), "etc/h")
+
+    def test_cache_bounded(self):
+        """ Ensures that only the most recently used rankings are cached, and that the one we're narrowing from sticks around. """
+        index = Index()
+        index.add(self.SEARCH_DIR, self.make_fns("abc.txt", "abd.txt", "xyz.txt"))
+        root = index.roots[self.SEARCH_DIR]
+
+        self.query(index, "a")
+        for query_idx in xrange(2 * root.MAX_CACHED_RANKINGS):
+            self.query(index, "a")
+            self.query(index, "x{:d}".format(query_idx))
+        self.assertEqual(len(root.cache), root.MAX_CACHED_RANKINGS)
+
+        self.assertEqual(self.query(index, "ab"), [ "abc.txt", "abd.txt" ])
+        self.assertEqual(list(root.cache)[-2:], [ (MATCH_FUZZY, "a"), (MATCH_FUZZY, "ab") ])
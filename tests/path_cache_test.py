@@ -0,0 +1,23 @@
+import unittest
+
+from completeme.utils import PathCache
+
+class PathCacheTest(unittest.TestCase):
+
+    def test_invalidated_while_computing(self):
+        """ Ensures that a value computed while the cache was invalidated isn't kept around. """
+        cache = PathCache(ttl=60)
+        def compute_fn(key):
+            cache.invalidate()
+            return "stale"
+
+        self.assertEqual(cache.get("isdir", "/a", compute_fn), "stale")
+        self.assertEqual(cache.get("isdir", "/a", lambda key: "fresh"), "fresh")
+        self.assertEqual(cache.get("isdir", "/a", lambda key: "newer"), "fresh")
+
+    def test_max_entries(self):
+        """ Ensures that only the most recently computed entries are kept. """
+        cache = PathCache(ttl=60, max_entries=2)
+        for key in ("/a", "/b", "/c"):
+            cache.get("isdir", key, lambda key: key)
+        self.assertEqual(cache.entries.keys(), [ ("isdir", "/b"), ("isdir", "/c") ])
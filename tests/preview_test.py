@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from completeme.preview import PreviewThread
+
+class PreviewTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = os.path.realpath(tempfile.mkdtemp())
+        self.preview_thread = PreviewThread()
+        self.preview_thread.start()
+
+    def tearDown(self):
+        self.preview_thread.stop()
+        self.preview_thread.join()
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, fn, contents):
+        abs_fn = os.path.join(self.tmp_dir, fn)
+        with open(abs_fn, "wb") as f:
+            f.write(contents)
+        return abs_fn
+
+    def get_preview_lines(self, abs_fn):
+        """ Helper for asking the thread for a preview and waiting for it. """
+        self.preview_thread.request(abs_fn)
+
+        start = time.time()
+        while True:
+            preview = self.preview_thread.get_preview(abs_fn)
+            if preview is None:
+                if self.preview_thread.get_traceback() is not None:
+                    raise Exception(self.preview_thread.get_traceback())
+                if time.time() - start > 2:
+                    raise Exception("This should have taken way less than two seconds...")
+                time.sleep(0.01)
+                continue
+
+            return preview.lines
+
+    def test_text_file(self):
+        """ Ensures that a text file's lines show up with tabs expanded and other control characters dropped. """
+        abs_fn = self.write("a.txt", "\tfoo\r\n\x1b[31mbar\x7f")
+        self.assertEqual(self.get_preview_lines(abs_fn), [ "    foo", "[31mbar" ])
+
+    def test_binary_file(self):
+        abs_fn = self.write("a.bin", "ELF\0\0\1")
+        self.assertEqual(self.get_preview_lines(abs_fn), [ "(binary file, 6 bytes)" ])
+
+    def test_empty_file(self):
+        abs_fn = self.write("empty.txt", "")
+        self.assertEqual(self.get_preview_lines(abs_fn), [ "(empty file)" ])
+
+    def test_directory(self):
+        os.mkdir(os.path.join(self.tmp_dir, "subdir"))
+        self.write("a.txt", "a")
+        self.assertEqual(self.get_preview_lines(self.tmp_dir), [ "a.txt", "subdir/" ])
+
+    def test_unreadable(self):
+        """ Ensures that files we can't read (or map) get a message rather than killing the thread. """
+        abs_fn = os.path.join(self.tmp_dir, "dangling")
+        os.symlink(os.path.join(self.tmp_dir, "nowhere"), abs_fn)
+        self.assertTrue(self.get_preview_lines(abs_fn)[0].startswith("(couldn't read"))
+
+        # sysfs files say they've got 4096 bytes, but can't be mapped
+        sysfs_fn = "/sys/kernel/mm/transparent_hugepage/enabled"
+        if os.path.exists(sysfs_fn):
+            self.assertTrue(self.get_preview_lines(sysfs_fn))
+        self.assertTrue(self.preview_thread.is_alive())
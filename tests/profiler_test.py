@@ -0,0 +1,50 @@
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from completeme import profiler
+
+class ProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_sampling_profiler(self):
+        """ Ensures that we sample every thread and report how long they waited for instrumented locks. """
+        lock = profiler.InstrumentedLock("TestLock")
+        def hold_lock():
+            profiler.register_thread()
+            with lock:
+                time.sleep(0.1)
+
+        sampler = profiler.SamplingProfiler(self.tmp_dir)
+        sampler.start()
+        while not profiler._profiling:
+            time.sleep(0.001)
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        time.sleep(0.02)
+        with lock:
+            pass
+        holder.join()
+
+        sampler.stop()
+        sampler.join()
+
+        collapsed_fn, summary_fn = sampler.report_fns
+        with open(collapsed_fn) as f:
+            stacks = f.read()
+        self.assertIn("hold_lock (profiler_test.py:", stacks)
+        self.assertIn("MainThread;", stacks)
+
+        with open(summary_fn) as f:
+            main_thread_waits = [ line.split() for line in f if line.startswith("TestLock") and "MainThread" in line ]
+        self.assertEqual(len(main_thread_waits), 1)
+        self.assertTrue(float(main_thread_waits[0][-1]) > 0.05)
+        self.assertFalse(profiler._profiling)
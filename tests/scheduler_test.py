@@ -0,0 +1,18 @@
+import threading
+import unittest
+
+from completeme.scheduler import Scheduler
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_yield_to_search(self):
+        """ Ensures that ingestion waits for a pending search, but never for longer than max_backoff. """
+        scheduler = Scheduler(max_backoff=0.2)
+        self.assertEqual(scheduler.yield_to_search(), 0.0)
+
+        scheduler.search_requested()
+        self.assertTrue(0.2 <= scheduler.yield_to_search() < 1)
+
+        threading.Timer(0.02, scheduler.search_finished).start()
+        self.assertTrue(scheduler.yield_to_search() < 0.2)
+        self.assertFalse(scheduler.is_search_pending())
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from completeme.content import TrigramIndex, _get_trigrams
+
+class TrigramIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.index_fn = os.path.join(self.tmp_dir, "index", "test.trigrams")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def add_file(self, index, fn, contents):
+        abs_fn = os.path.join(self.tmp_dir, fn)
+        with open(abs_fn, "wb") as f:
+            f.write(contents)
+        index.add_file(abs_fn, os.stat(abs_fn), _get_trigrams(contents.lower()))
+        return abs_fn
+
+    def test_get_trigrams(self):
+        """ Ensures that we find every overlapping trigram. """
+        self.assertEqual(_get_trigrams("abcd"), set(["abc", "bcd"]))
+        self.assertEqual(_get_trigrams("ab"), set())
+
+    def test_save_and_load(self):
+        """ Ensures that files indexed in memory and files loaded from disk are both found, and that reindexed files don't leave stale matches behind. """
+        index = TrigramIndex(self.index_fn)
+        needle_fn = self.add_file(index, "needle.txt", "a needle in a haystack")
+        hay_fn = self.add_file(index, "hay.txt", "just hay")
+
+        self.assertEqual(index.get_candidate_files(_get_trigrams("needle")), [ needle_fn ])
+        self.assertEqual(index.get_candidate_files(_get_trigrams("hay")), [ needle_fn, hay_fn ])
+        index.save()
+        index.close()
+
+        index = TrigramIndex(self.index_fn)
+        self.assertTrue(index.is_current(needle_fn, os.stat(needle_fn)))
+        self.assertEqual(index.get_candidate_files(_get_trigrams("needle")), [ needle_fn ])
+
+        # move the needle
+        self.add_file(index, "needle.txt", "nothing to see here")
+        self.add_file(index, "hay.txt", "oh, a needle")
+        self.assertEqual(index.get_candidate_files(_get_trigrams("needle")), [ hay_fn ])
+        index.save()
+        self.assertEqual(index.get_candidate_files(_get_trigrams("needle")), [ hay_fn ])
+        self.assertEqual(len(index.files), 2)
+        index.close()
+
+    def test_reindexed_before_save(self):
+        """ Ensures that a file reindexed before it was ever saved is only found once. """
+        index = TrigramIndex(self.index_fn)
+        abs_fn = self.add_file(index, "a.txt", "hello")
+        os.utime(abs_fn, (0, 0))
+        self.add_file(index, "a.txt", "hello again")
+
+        self.assertEqual(index.get_candidate_files(_get_trigrams("hel")), [ abs_fn ])
+        index.save()
+        self.assertEqual(index.get_candidate_files(_get_trigrams("hel")), [ abs_fn ])
+        index.close()
+
+    def test_stale_and_deleted(self):
+        """ Ensures that a few stale files are left as nulls (without renumbering) and deleted files are forgotten once there are enough of them. """
+        index = TrigramIndex(self.index_fn)
+        abs_fns = [ self.add_file(index, "{:d}.txt".format(idx), "hay {:d}".format(idx)) for idx in xrange(8) ]
+        index.save()
+
+        os.utime(abs_fns[0], (0, 0))
+        self.add_file(index, "0.txt", "a needle")
+        index.save()
+        index.close()
+
+        index = TrigramIndex(self.index_fn)
+        self.assertEqual(len(index.files), 9)
+        self.assertEqual(index.get_candidate_files(_get_trigrams("needle")), [ abs_fns[0] ])
+        self.assertEqual(index.get_candidate_files(_get_trigrams("hay")), abs_fns[1:])
+
+        for abs_fn in abs_fns[1:4]:
+            os.remove(abs_fn)
+        index.remove_missing_files()
+        index.save()
+        self.assertEqual(len(index.files), 5)
+        self.assertEqual(index.get_candidate_files(_get_trigrams("needle")), [ abs_fns[0] ])
+        self.assertEqual(index.get_candidate_files(_get_trigrams("hay")), abs_fns[4:])
+        index.close()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+from completeme.collection import FilenameCollectionThread
+from completeme.utils import get_config
+
+class UntrackedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = os.path.realpath(tempfile.mkdtemp())
+        for fn in ("tracked.txt", "small1/a", "small1/b", "small1/c", "small2/a", "small2/b", "small2/c", "big/a", "big/b", "big/c", "big/d", "big/e", "big/f"):
+            if not os.path.isdir(os.path.dirname(os.path.join(self.tmp_dir, fn))):
+                os.makedirs(os.path.dirname(os.path.join(self.tmp_dir, fn)))
+            open(os.path.join(self.tmp_dir, fn), "w").close()
+        with open(os.devnull, "w") as devnull:
+            for args in ([ "git", "init" ], [ "git", "add", "tracked.txt" ]):
+                subprocess.check_call(args, cwd=self.tmp_dir, stdout=devnull, stderr=devnull)
+
+        get_config("include_directories") # (loads the config)
+        self.orig_config = get_config.cached_config
+
+    def tearDown(self):
+        get_config.cached_config = self.orig_config
+        shutil.rmtree(self.tmp_dir)
+
+    def collect(self, input_str, collapse_threshold, max_entries):
+        """ Helper for collecting with the given untracked budgets and returning (relative filenames, truncated). """
+        get_config.cached_config = dict(self.orig_config, git_untracked_collapse_threshold=collapse_threshold, git_untracked_max_entries=max_entries)
+        bg_thread = FilenameCollectionThread(input_str)
+        bg_thread.start()
+
+        start = time.time()
+        while True:
+            current_filenames = bg_thread.get_current_filenames()
+            if not current_filenames.candidate_computation_complete:
+                if time.time() - start > 5:
+                    raise Exception("This should have taken way less than five seconds...")
+                time.sleep(0.01)
+                continue
+
+            bg_thread.stop()
+            return sorted( os.path.relpath(fn, self.tmp_dir) for fn in current_filenames.candidates ), current_filenames.candidate_computation_truncated
+
+    def test_collapse(self):
+        """ Ensures that small untracked directories are expanded and big ones are collapsed, without counting as truncated. """
+        fns, truncated = self.collect(os.path.join(self.tmp_dir, ""), 5, 100)
+        self.assertEqual(fns, [ "big", "small1", "small1/a", "small1/b", "small1/c", "small2", "small2/a", "small2/b", "small2/c", "tracked.txt" ])
+        self.assertFalse(truncated)
+
+    def test_budget(self):
+        """ Ensures that we stop expanding untracked directories once we're out of budget. """
+        fns, truncated = self.collect(os.path.join(self.tmp_dir, ""), 5, 4)
+        expanded = [ dirname for dirname in ("small1", "small2") if os.path.join(dirname, "a") in fns ]
+        self.assertEqual(len(expanded), 1)
+        self.assertTrue(set([ "big", "small1", "small2", "tracked.txt" ]).issubset(fns))
+        self.assertTrue(truncated)
+
+    def test_untracked_search_dir(self):
+        """ Ensures that typing into an untracked directory lists as much of it as the budget allows. """
+        big_dir = os.path.join(self.tmp_dir, "big", "")
+        fns, truncated = self.collect(big_dir, 5, 100)
+        self.assertEqual(fns, [ "big/a", "big/b", "big/c", "big/d", "big/e", "big/f" ])
+        self.assertFalse(truncated)
+
+        fns, truncated = self.collect(big_dir, 5, 4)
+        self.assertEqual(len(fns), 4)
+        self.assertTrue(truncated)
@@ -4,36 +4,42 @@ import time
 import unittest
 
 from completeme.collection import CurrentFilenames
+from completeme.index import Index
 from completeme.search import SearchThread
 
-class UserInputRegexTest(unittest.TestCase):
+def run_search(input_str, current_filenames, extra_filenames=(), frecency_store=None):
+    """ Helper for spinning up a SearchThread and waiting for its (complete) EligibleFilenames. """
+    bg_thread = SearchThread(input_str, current_filenames, extra_filenames, frecency_store=frecency_store)
+    bg_thread.start()
+
+    start = time.time()
+    while True:
+        eligible_fns = bg_thread.get_eligible_filenames()
+        if not eligible_fns.search_complete:
+            if time.time() - start > 2:
+                raise Exception("This should have taken way less than two seconds...")
+            time.sleep(0.01)
+            continue
+
+        bg_thread.stop()
+        return eligible_fns
+
+def make_filenames(search_dir, candidates, complete=True):
+    """ Helper for making CurrentFilenames out of filenames relative to search_dir. """
+    return CurrentFilenames(
+            candidates=set( os.path.join(search_dir, fn) for fn in candidates ),
+            candidate_computation_complete=complete,
+            candidate_computation_truncated=False,
+            current_search_dir=search_dir,
+            git_root_dir=None)
 
-    def compute_eligible_filenames(self, input_str, candidates):
-        """ Helper for spinning up a thread and waiting for results. """
+class UserInputRegexTest(unittest.TestCase):
 
-        cwd = os.path.abspath(".")
-        # prepend cwd
-        bg_thread = SearchThread(
-                input_str,
-                CurrentFilenames(
-                    candidates=map(lambda x: os.path.join(cwd, x), candidates),
-                    candidate_computation_complete=True,
-                    current_search_dir=cwd,
-                    git_root_dir=None)
-                )
-        bg_thread.start()
-
-        start = time.time()
-        while True:
-            eligible_fns = bg_thread.get_eligible_filenames()
-            if not eligible_fns.search_complete:
-                if time.time() - start > 2:
-                    raise Exception("This should have taken way less than two seconds...")
-                time.sleep(0.01)
-                continue
-
-            # take off our prepended path
-            return [ os.path.relpath(eligible_fn.abs_fn) for eligible_fn in eligible_fns.eligible ]
+    def compute_eligible_filenames(self, input_str, candidates, extra_roots=()):
+        """ Helper for searching candidates (relative to cwd) and any extra_roots (CurrentFilenames) and returning the eligible filenames relative to cwd. """
+        eligible_fns = run_search(input_str, make_filenames(os.path.abspath("."), candidates), extra_roots)
+        # take off our prepended path
+        return [ os.path.relpath(eligible_fn.abs_fn) for eligible_fn in eligible_fns.eligible ]
 
     def test_regexy_characters(self):
         """ Ensures that even if the user inputs things like . and * and ? that we won't explode. """
@@ -100,3 +106,49 @@ class UserInputRegexTest(unittest.TestCase):
         E = "MavisBeaconEnters/src/main/resources/whatever.txt"
         F = "MavisBeaconEnters/src/main/java/com/mavisbeacon/app/enters/typing/is/fun/MBEResource.java"
         run_test("mberesource", [E, F], [F, E]) # push off the match as much as possible to get the grouping at the end
+
+    def test_match_positions(self):
+        """ Ensures that match positions are computed only for the requested number of eligible filenames and line up with the match. """
+        cwd = os.path.abspath(".")
+        index = Index()
+        index.add(cwd, [ os.path.join(cwd, fn) for fn in ("abc.txt", "a/b/c.txt", "xyz.txt") ])
+
+        eligible_fns = index.query("abc", limit=1)
+        self.assertEqual(eligible_fns.num_eligible, 2)
+        self.assertEqual(len(eligible_fns.eligible), 1)
+
+        best = eligible_fns.eligible[0]
+        self.assertEqual(os.path.relpath(best.abs_fn), "abc.txt")
+        self.assertEqual("".join(best.abs_fn[pos] for pos in best.abs_match_positions), "abc")
+
+    def test_extra_search_roots(self):
+        """ Ensures that matches from extra search roots are ranked together with the current search directory's. """
+        other_root = "/some/other/root"
+        self.assertEqual(
+                self.compute_eligible_filenames("readme", [ "docs/README.txt", "unrelated.txt" ], [ make_filenames(other_root, [ "README" ], complete=False) ]),
+                [ os.path.relpath(os.path.join(other_root, "README")), "docs/README.txt" ])
+
+    def test_match_modes(self):
+        """ Ensures that query prefixes pick the match mode, and that regexy characters only mean something in glob and regex modes. """
+        README = "README.md"
+        SETUP = "setup.py"
+        SRC_MAIN = "src/main.py"
+        SRC_README = "src/docs/readme.txt"
+        ELIGIBLE_FILENAMES = [ README, SETUP, SRC_MAIN, SRC_README ]
+
+        def run_test(input_str, expected):
+            self.assertEqual(
+                    sorted(self.compute_eligible_filenames(input_str, ELIGIBLE_FILENAMES)),
+                    sorted(expected)
+                    )
+
+        run_test("smp", [ SRC_MAIN ])
+        run_test("'smp", [])                                    # substring
+        run_test("'in.p", [ SRC_MAIN ])
+        run_test("^read", [ README, SRC_README ])               # prefix of the basename
+        run_test("^src", [])
+        run_test("=*.py", [ SETUP, SRC_MAIN ])                  # glob against the basename...
+        run_test("=src/*", [ SRC_MAIN ])                        # ...or the whole relative path
+        run_test("@^.*\\.(md|txt)$", [ README, SRC_README ])    # regex
+        run_test("@^src/", [ SRC_MAIN, SRC_README ])
+        run_test("@[", [])                                      # bad regex
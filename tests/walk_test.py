@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from completeme.collection import FilenameCollectionThread
+from completeme.utils import get_config
+
+class WalkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = os.path.realpath(tempfile.mkdtemp())
+        for fn in ("a", "b", "c", "sub1/d", "sub1/e", "sub2/f", "sub2/deeper/g", "releases/v3/app.py"):
+            if not os.path.isdir(os.path.dirname(os.path.join(self.tmp_dir, fn))):
+                os.makedirs(os.path.dirname(os.path.join(self.tmp_dir, fn)))
+            open(os.path.join(self.tmp_dir, fn), "w").close()
+        os.symlink("releases/v3", os.path.join(self.tmp_dir, "current"))
+        os.symlink("..", os.path.join(self.tmp_dir, "sub1", "loop"))
+
+        get_config("include_directories") # (loads the config)
+        self.orig_config = get_config.cached_config
+
+    def tearDown(self):
+        get_config.cached_config = self.orig_config
+        shutil.rmtree(self.tmp_dir)
+
+    def collect(self, **config):
+        """ Helper for walking tmp_dir as a breadth-first root with the given config and returning (relative filenames, truncated). """
+        get_config.cached_config = dict(self.orig_config, breadth_first_roots=[ self.tmp_dir ], **config)
+        bg_thread = FilenameCollectionThread(os.path.join(self.tmp_dir, ""))
+        bg_thread.start()
+
+        start = time.time()
+        while True:
+            current_filenames = bg_thread.get_current_filenames()
+            if not current_filenames.candidate_computation_complete:
+                if time.time() - start > 2:
+                    raise Exception("This should have taken way less than two seconds...")
+                time.sleep(0.01)
+                continue
+
+            bg_thread.stop()
+            return sorted( os.path.relpath(fn, self.tmp_dir) for fn in current_filenames.candidates ), current_filenames.candidate_computation_truncated
+
+    def test_walk(self):
+        """ Ensures that a directory reachable by two paths is walked under both, but a symlink cycle is only listed. """
+        fns, truncated = self.collect()
+        self.assertEqual(fns, [
+            "a", "b", "c", "current", "current/app.py",
+            "releases", "releases/v3", "releases/v3/app.py",
+            "sub1", "sub1/d", "sub1/e", "sub1/loop",
+            "sub2", "sub2/deeper", "sub2/deeper/g", "sub2/f" ])
+        self.assertFalse(truncated)
+
+    def test_max_entries(self):
+        """ Ensures that we stop (shallowest first) once we've run out of the total budget. """
+        fns, truncated = self.collect(breadth_first_max_entries=8)
+        self.assertEqual(len(fns), 8)
+        self.assertTrue(set([ "a", "b", "c", "current", "releases", "sub1", "sub2" ]).issubset(fns))
+        self.assertTrue(truncated)
+
+    def test_max_entries_per_level(self):
+        """ Ensures that we list no more than the per-level budget from each level, but still go deeper. """
+        fns, truncated = self.collect(breadth_first_max_entries_per_level=2)
+        self.assertEqual(len([ fn for fn in fns if "/" not in fn ]), 2)
+        self.assertTrue(any( "/" in fn for fn in fns ))
+        self.assertTrue(truncated)
+
+    def test_same_filesystem(self):
+        """ Ensures that we don't descend into other filesystems when asked not to. """
+        if os.stat("/proc").st_dev == os.stat(self.tmp_dir).st_dev:
+            return
+        os.symlink("/proc/self", os.path.join(self.tmp_dir, "proc"))
+
+        fns, _ = self.collect(breadth_first_same_filesystem=True)
+        self.assertIn("proc", fns)
+        self.assertFalse(any( fn.startswith("proc/") for fn in fns ))